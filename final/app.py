@@ -1,14 +1,113 @@
-from flask import Flask, request, render_template_string, render_template, redirect, url_for
+from flask import Flask, request, render_template_string, render_template, redirect, url_for, jsonify
+import click
+import functools
 import os
-import subprocess
+import threading
 import time
+import uuid
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import is_running_from_reloader
 from werkzeug.utils import secure_filename
-from language_parser.driver import run_test
+from language_parser.cache import FingerprintCache
+from language_parser.reports import SimilarityReports
+from grader.jobs import JobQueue, QueueFullException
+from grader.dispatch import TestDispatcher
+from grader.sandbox import run_limited, OK, WRONG_ANSWER
+from grader.compare import make_comparator
+from grader.compile_cache import CompileCache, CompilationException
+from grader.regrade import regrade, write_scores
+from grader.problems import ProblemStore
+from grader.python_pool import PythonPool, resolve_python
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB limit
 app.config['PROBLEMS_FOLDER'] = 'problems'
+app.config['CACHE_FOLDER'] = 'cache'
+app.config['TEST_WORKERS'] = os.cpu_count() or 4  # Test cases run at once across all problems
+app.config['MAX_TESTS_PER_PROBLEM'] = 4  # Test cases of one problem run at once
+app.config['JOBS_DATABASE'] = 'jobs.sqlite3'
+app.config['COMPILE_CACHE_FOLDER'] = 'compile_cache'
+app.config['C_FLAGS'] = []
+# Per test case, a problem's limits.txt can override them
+app.config['DEFAULT_LIMITS'] = {
+    'wall_time': 5.0,  # seconds
+    'cpu_time': 2.0,  # seconds
+    'memory_mb': 256,
+    'output_mb': 64,
+}
+app.config['GRADER_WORKERS'] = 2  # Submissions graded at once
+app.config['MAX_PENDING_JOBS'] = 200  # Submissions waiting before /submit turns new ones away
+app.config['REGRADE_WORKERS'] = os.cpu_count() or 4  # Submissions graded at once by a regrade
+app.config['REPORTS_FOLDER'] = 'reports'
+# Warm interpreters running Python test cases, 0 starts a fresh interpreter
+# per test case. Test cases beyond it wait, so match TEST_WORKERS.
+app.config['PYTHON_POOL_SIZE'] = 0
+# Pairs listed by /result: the lowest similarity and the number of most
+# similar pairs, None for all. Reports limited by a top K are recomputed in
+# full when submissions change instead of incrementally.
+app.config['SIMILARITY_MIN'] = 0
+app.config['SIMILARITY_TOP_K'] = None
+# Only compare the pairs a MinHash LSH prefilter selects, for large classes.
+# More bands find more similar pairs, more rows let fewer dissimilar ones
+# through. None compares every pair sharing a subtree.
+app.config['SIMILARITY_LSH_BANDS'] = None
+app.config['SIMILARITY_LSH_ROWS'] = 3
+
+fingerprint_cache = FingerprintCache(app.config['CACHE_FOLDER'])
+problem_store = ProblemStore(app.config['PROBLEMS_FOLDER'], app.config['DEFAULT_LIMITS'])
+compile_cache = CompileCache(app.config['COMPILE_CACHE_FOLDER'], flags=app.config['C_FLAGS'])
+
+def compute_similarity_report(directory, previous):
+    # Loading the parsers is only worth it for the similarity report
+    from language_parser.driver import run_test
+    from language_parser.minhash import MinHashLSH
+
+    lsh = None
+    if app.config['SIMILARITY_LSH_BANDS'] is not None:
+        lsh = MinHashLSH(app.config['SIMILARITY_LSH_BANDS'], app.config['SIMILARITY_LSH_ROWS'])
+
+    return run_test(
+        directory,
+        cache=fingerprint_cache,
+        previous=previous,
+        min_similarity=app.config['SIMILARITY_MIN'],
+        top_k=app.config['SIMILARITY_TOP_K'],
+        lsh=lsh,
+    )
+
+# Similarity reports of uploads/problemN, recomputed when submissions change
+similarity_reports = SimilarityReports(compute_similarity_report)
+
+# The interpreter and the warm pool are set up by the first Python test
+# case, not on import, so CLI commands and the reloader's watching process
+# don't start any subprocess for them
+python_executable = None
+python_pool = None
+python_lock = threading.Lock()
+
+def python_runner(script_path):
+    """
+    Returns:
+        A function (input bytes, limits, output) -> RunResult running the
+        Python script, in the warm pool if there is one
+    """
+    global python_executable, python_pool
+    with python_lock:
+        if python_executable is None:
+            executable = resolve_python()
+            if app.config['PYTHON_POOL_SIZE'] > 0:
+                python_pool = PythonPool(executable, app.config['PYTHON_POOL_SIZE'])
+            python_executable = executable
+
+    if python_pool is not None:
+        return functools.partial(python_pool.run, script_path)
+    return functools.partial(run_limited, [python_executable, script_path])
+
+test_executor = ThreadPoolExecutor(max_workers=app.config['TEST_WORKERS'])
+# Test cases of a problem beyond its limit wait outside of the executor
+test_dispatcher = TestDispatcher(test_executor, app.config['MAX_TESTS_PER_PROBLEM'])
 
 difficulty_to_marks = {
     'easy': 1,
@@ -20,13 +119,25 @@ difficulty_to_marks = {
 def index():
     return render_template('index.html')
 
+def run_test_case(run_program, test_case, limits, checker):
+    """
+    Run one test case. The output is compared with the expected one while
+    the program runs.
+
+    Arguments:
+        run_program: A function (input bytes, limits, output) -> RunResult,
+            like run_limited() with the command bound
+
+    Returns:
+        (the RunResult of the test case, whether the output matched)
+    """
+    comparator = make_comparator(test_case.expected_output, *checker)
+    run = run_program(test_case.input, limits, output=comparator)
+    return run, comparator.matched()
+
 def run_test_cases(problem_number, script_path):
-    test_case_dir = os.path.join(app.config['PROBLEMS_FOLDER'], f"problem{problem_number}")
-    input_dir = os.path.join(test_case_dir, "inputs")
-    output_dir = os.path.join(test_case_dir, "outputs")
-    metadata_dir = os.path.join(test_case_dir, "metadata")
+    problem = problem_store.get(problem_number)
 
-    total_marks = 0
     obtained_marks = 0
 
     script_extension = os.path.splitext(script_path)[1]
@@ -34,51 +145,46 @@ def run_test_cases(problem_number, script_path):
     is_c = script_extension == ".c"
     
     if is_c:
-        executable_path = script_path.replace(".c", "")
-        compile_start_time = time.time()
-        compile_process = subprocess.run(['gcc', script_path, '-o', executable_path], capture_output=True, text=True)
-        compile_end_time = time.time()
-        compile_time = compile_end_time - compile_start_time
-        if compile_process.returncode != 0:
-            return f"Compilation failed: {compile_process.stderr}", 0, 0
-
-    for input_file in os.listdir(input_dir):
-        if input_file.startswith("input") and input_file.endswith(".txt"):
-            test_index = input_file.replace("input", "").replace(".txt", "")
-            output_file = f"output{test_index}.txt"
-            metadata_file = f"metadata{test_index}.txt"
-
-            with open(os.path.join(input_dir, input_file), 'r') as inp:
-                expected_output = open(os.path.join(output_dir, output_file), 'r').read().strip()
-                with open(os.path.join(metadata_dir, metadata_file), 'r') as meta:
-                    difficulty, marks = meta.read().strip().split('\n')
-                    marks = int(marks)
-                    total_marks += marks
-
-                if is_python:
-                    start_time = time.time()
-                    try:
-                        process = subprocess.run(['python', script_path], stdin=inp, capture_output=True, text=True)
-                    except FileNotFoundError:
-                        process = subprocess.run(['python3', script_path], stdin=inp, capture_output=True, text=True)
-                    end_time = time.time()
-                elif is_c:
-                    start_time = time.time()
-                    process = subprocess.run([executable_path], stdin=inp, capture_output=True, text=True)
-                    end_time = time.time()
-
-                runtime = end_time - start_time
-                actual_output = process.stdout.strip()
-
-                if actual_output == expected_output:
-                    obtained_marks += marks
-
-                print(f"Test case {test_index}: runtime = {runtime:.4f} seconds")
+        try:
+            executable_path, compile_time = compile_cache.compile(script_path)
+        except CompilationException as e:
+            return f"Compilation failed: {e}", 0, 0, []
+
+    if is_python:
+        run_program = python_runner(script_path)
+    elif is_c:
+        run_program = functools.partial(run_limited, [executable_path])
+
+    # Queue all test cases, then collect them in test order. Jobs pass the
+    # problem number as text and regrades as a number, both share one limit.
+    futures = [
+        test_dispatcher.submit(str(problem_number), run_test_case, run_program, test_case, problem.limits, problem.checker)
+        for test_case in problem.test_cases
+    ]
+
+    test_results = []
+    for (test_case, future) in zip(problem.test_cases, futures):
+        run, matched = future.result()
+
+        status = run.status
+        if status == OK and not matched:
+            status = WRONG_ANSWER
+        if status == OK:
+            obtained_marks += test_case.marks
+
+        test_results.append({
+            'test': test_case.index,
+            'status': status,
+            'marks': test_case.marks if status == OK else 0,
+            'wall_time': run.wall_time,
+            'cpu_time': run.cpu_time,
+            'peak_rss_kb': run.peak_rss_kb,
+        })
 
     if is_c:
-        return obtained_marks, total_marks, compile_time
+        return obtained_marks, problem.total_marks, compile_time, test_results
     else:
-        return obtained_marks, total_marks, 0
+        return obtained_marks, problem.total_marks, 0, test_results
 
 @app.route('/submit', methods=['POST'])
 def submit():
@@ -89,13 +195,119 @@ def submit():
         if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], f'problem{problem_number}')):
             os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], f'problem{problem_number}'))
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], f'problem{problem_number}', filename)
-        file.save(filepath)
 
-        obtained_marks, total_marks, compile_time = run_test_cases(problem_number, filepath)
-        return f'You scored {obtained_marks} out of {total_marks} marks.\nCompilation time: {compile_time:.4f} seconds.'
+        # Saved only once the queue accepted it, so a rejected submission
+        # doesn't end up in the similarity report or a regrade
+        try:
+            job_id = grading_queue.submit(problem_number, filepath, save=lambda: file.save(filepath))
+        except QueueFullException:
+            return 'The grader is busy, please submit again in a minute.', 503
+        similarity_reports.refresh(os.path.join(app.config['UPLOAD_FOLDER'], f'problem{problem_number}'))
+        return f'Submission queued as job {job_id}.\nCheck /status/{job_id} for your score.'
 
     return 'No file uploaded.'
 
+def grade_submission(problem_number, script_path):
+    obtained_marks, total_marks, compile_time, test_results = run_test_cases(problem_number, script_path)
+    if isinstance(obtained_marks, str):
+        # Compilation failed, obtained_marks holds the compiler message
+        return {'message': obtained_marks}
+
+    return {
+        'obtained_marks': obtained_marks,
+        'total_marks': total_marks,
+        'compile_time': compile_time,
+        'tests': test_results,
+        'message': f'You scored {obtained_marks} out of {total_marks} marks.\nCompilation time: {compile_time:.4f} seconds.',
+    }
+
+def regrade_problem(problem_number, workers=None):
+    """
+    Regrade every submission of a problem, e.g. after its test cases changed,
+    and write the score table to REPORTS_FOLDER as CSV and JSON
+
+    Returns:
+        A summary with the number of submissions, the elapsed time, the
+        throughput and the paths of the tables
+    """
+    upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], f'problem{problem_number}')
+    script_paths = []
+    if os.path.exists(upload_dir):
+        script_paths = [
+            os.path.join(upload_dir, filename)
+            for filename in sorted(os.listdir(upload_dir))
+            if filename.endswith('.py') or filename.endswith('.c')
+        ]
+
+    rows, elapsed = regrade(
+        problem_number,
+        script_paths,
+        grade_submission,
+        workers=workers or app.config['REGRADE_WORKERS'],
+    )
+    csv_path = os.path.join(app.config['REPORTS_FOLDER'], f'problem{problem_number}_scores.csv')
+    json_path = os.path.join(app.config['REPORTS_FOLDER'], f'problem{problem_number}_scores.json')
+    write_scores(rows, csv_path, json_path)
+
+    return {
+        'problem_number': problem_number,
+        'submissions': len(rows),
+        'elapsed': elapsed,
+        'submissions_per_second': len(rows) / elapsed if elapsed > 0 else 0,
+        'csv': csv_path,
+        'json': json_path,
+    }
+
+# Regrades started from /admin/regrade, one at a time
+regrade_executor = ThreadPoolExecutor(max_workers=1)
+# Regrade ID -> (problem number, Future of its summary)
+regrade_runs = {}
+
+@app.route('/admin/regrade/<int:problem_number>', methods=['POST'])
+def admin_regrade(problem_number):
+    regrade_id = uuid.uuid4().hex
+    regrade_runs[regrade_id] = (problem_number, regrade_executor.submit(regrade_problem, problem_number))
+    return jsonify({
+        'id': regrade_id,
+        'status_url': url_for('regrade_status', regrade_id=regrade_id),
+    }), 202
+
+@app.route('/admin/regrade/status/<regrade_id>')
+def regrade_status(regrade_id):
+    if regrade_id not in regrade_runs:
+        return jsonify({'error': 'Regrade not found.'}), 404
+
+    problem_number, future = regrade_runs[regrade_id]
+    status = {'id': regrade_id, 'problem_number': problem_number}
+    if not future.done():
+        status['status'] = 'running' if future.running() else 'queued'
+    elif future.exception() is not None:
+        status['status'] = 'failed'
+        status['error'] = f'{type(future.exception()).__name__}: {future.exception()}'
+    else:
+        status['status'] = 'done'
+        status['summary'] = future.result()
+    return jsonify(status)
+
+@app.cli.command('regrade')
+@click.argument('problem_number', type=int)
+@click.option('--workers', type=int, default=None, help='Submissions graded at once.')
+def regrade_command(problem_number, workers):
+    """Regrade all submissions of a problem."""
+    summary = regrade_problem(problem_number, workers)
+    click.echo(
+        f"Regraded {summary['submissions']} submissions in {summary['elapsed']:.2f} seconds "
+        f"({summary['submissions_per_second']:.2f} submissions/s)"
+    )
+    click.echo(f"Scores written to {summary['csv']} and {summary['json']}")
+
+@app.route('/status/<job_id>')
+def get_status(job_id):
+    job = grading_queue.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(job)
+
 @app.route('/description/<int:problem_number>')
 def get_description(problem_number):
     description_path = os.path.join(app.config['PROBLEMS_FOLDER'], f'problem{problem_number}', 'description.md')
@@ -107,12 +319,21 @@ def get_description(problem_number):
 
 @app.route('/result/<int:problem_number>')
 def get_result(problem_number):
-    try:
-        data_python, data_c = run_test(f'uploads/problem{problem_number}')
-        return render_template('result.html', data_python=data_python, data_c=data_c)
-    except:
+    report = similarity_reports.get(os.path.join(app.config['UPLOAD_FOLDER'], f'problem{problem_number}'))
+    if report['report'] is None:
         return "No results found."
 
+    data_python, data_c = report['report']
+    return render_template(
+        'result.html',
+        data_python=data_python,
+        data_c=data_c,
+        computed_at=datetime.fromtimestamp(report['computed_at']).strftime('%Y-%m-%d %H:%M:%S'),
+        age=int(time.time() - report['computed_at']),
+        stale=report['stale'],
+        computing=report['computing'],
+    )
+
 @app.route('/admin', methods=['GET', 'POST'])
 def admin():
     if request.method == 'POST':
@@ -169,9 +390,28 @@ def save_examples(problem_number, input_examples, output_examples, difficulties)
         with open(os.path.join(metadata_dir, f'metadata{i+1}.txt'), 'w') as metadata_file:
             metadata_file.write(f"{difficulty.strip()}\n{marks}\n")
 
+    problem_store.invalidate(problem_number)
+
+grading_queue = JobQueue(
+    app.config['JOBS_DATABASE'],
+    grade_submission,
+    workers=app.config['GRADER_WORKERS'],
+    max_pending=app.config['MAX_PENDING_JOBS'],
+)
+
+@app.before_request
+def start_grading_queue():
+    # Graded by the process serving requests only, not on import, so CLI
+    # commands and the reloader's watching process never take jobs
+    grading_queue.start()
+
 if __name__ == '__main__':
     if not os.path.exists(app.config['UPLOAD_FOLDER']):
         os.makedirs(app.config['UPLOAD_FOLDER'])
     if not os.path.exists(app.config['PROBLEMS_FOLDER']):
         os.makedirs(app.config['PROBLEMS_FOLDER'])
+    # Pick up the jobs left by a previous run without waiting for a request,
+    # in the reloader's serving process only
+    if is_running_from_reloader():
+        grading_queue.start()
     app.run(debug=True)
@@ -0,0 +1,184 @@
+import codecs
+import math
+
+EXACT = "exact"
+TOKENS = "tokens"
+FLOAT = "float"
+
+DEFAULT_TOLERANCE = 1e-6
+# Characters a number may have beyond the longest expected token and still
+# be within the tolerance, like trailing zeros or extra digits
+FLOAT_TOKEN_SLACK = 64
+
+
+class Comparator:
+    """
+    Compare a program's output with the expected output while it is being
+    produced. feed() takes the raw stdout chunks as they arrive and returns
+    True once the output can no longer match, so the program can be stopped
+    right away. matched() gives the verdict once the program is done.
+
+    Like the graded output before, the bytes are decoded as UTF-8 with
+    replacement characters and \\r\\n counts as \\n.
+    """
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.pending_cr = False
+        self.mismatch = False
+
+    def feed(self, chunk):
+        """
+        Returns:
+            Whether the output already mismatched
+        """
+        if not self.mismatch:
+            text = self.decoder.decode(chunk)
+            self._feed_text(self._normalize(text))
+        return self.mismatch
+
+    def matched(self):
+        if not self.mismatch:
+            text = self.decoder.decode(b"", final=True)
+            if self.pending_cr:
+                text = "\r" + text
+                self.pending_cr = False
+            self._feed_text(text.replace("\r\n", "\n"))
+            self._finish()
+        return not self.mismatch
+
+    def _normalize(self, text):
+        # A \r at the end of a chunk may be the start of a \r\n
+        if self.pending_cr:
+            text = "\r" + text
+        self.pending_cr = text.endswith("\r")
+        if self.pending_cr:
+            text = text[:-1]
+        return text.replace("\r\n", "\n")
+
+    def _feed_text(self, text):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+
+class ExactComparator(Comparator):
+    """
+    Matches when the stripped output equals the stripped expected output
+    """
+    def __init__(self, expected_output):
+        super().__init__()
+        self.expected = expected_output.strip()
+        # Characters of the expected output matched so far, None while the
+        # leading whitespace of the output is skipped
+        self.position = None
+
+    def _feed_text(self, text):
+        if self.position is None:
+            stripped = text.lstrip()
+            if len(stripped) == 0:
+                return
+            text = stripped
+            self.position = 0
+
+        remaining = len(self.expected) - self.position
+        if remaining > 0:
+            if self.expected[self.position:self.position + len(text)] != text[:remaining]:
+                self.mismatch = True
+                return
+            self.position += min(remaining, len(text))
+            text = text[remaining:]
+
+        # Past the expected output only whitespace may follow
+        if len(text) > 0 and not text.isspace():
+            self.mismatch = True
+
+    def _finish(self):
+        if (self.position or 0) != len(self.expected):
+            self.mismatch = True
+
+
+class TokenComparator(Comparator):
+    """
+    Matches when the output has the same whitespace separated tokens as the
+    expected output, with numbers compared up to a tolerance if one is given
+    """
+    def __init__(self, expected_output, tolerance=None):
+        """
+        Arguments:
+            expected_output: The expected output
+            tolerance: The absolute or relative difference allowed between
+                two numbers, None to compare them as text
+        """
+        super().__init__()
+        self.expected = expected_output.split()
+        self.tolerance = tolerance
+        self.position = 0
+        # The last token of a chunk may continue in the next one
+        self.partial = ""
+        # A partial token longer than this can't match any expected token
+        self.max_token_length = max((len(token) for token in self.expected), default=0)
+        if tolerance is not None:
+            self.max_token_length += FLOAT_TOKEN_SLACK
+
+    def _same(self, token, expected):
+        if token == expected:
+            return True
+        if self.tolerance is None:
+            return False
+        try:
+            value, expected_value = float(token), float(expected)
+        except ValueError:
+            return False
+        if math.isnan(value) or math.isnan(expected_value):
+            return False
+        return math.isclose(value, expected_value, rel_tol=self.tolerance, abs_tol=self.tolerance)
+
+    def _match(self, tokens):
+        for token in tokens:
+            if self.position >= len(self.expected) or not self._same(token, self.expected[self.position]):
+                self.mismatch = True
+                return
+            self.position += 1
+
+    def _feed_text(self, text):
+        text = self.partial + text
+        tokens = text.split()
+        self.partial = ""
+        if len(tokens) > 0 and not text[-1].isspace():
+            self.partial = tokens.pop()
+        self._match(tokens)
+        # Output without whitespace would otherwise be joined and split again
+        # with every chunk
+        if len(self.partial) > self.max_token_length:
+            self.mismatch = True
+
+    def _finish(self):
+        if len(self.partial) > 0:
+            self._match([self.partial])
+            self.partial = ""
+        if self.position != len(self.expected):
+            self.mismatch = True
+
+
+# Checker mode -> function (expected output, tolerance) -> Comparator
+COMPARATORS = {
+    EXACT: lambda expected_output, tolerance: ExactComparator(expected_output),
+    TOKENS: lambda expected_output, tolerance: TokenComparator(expected_output),
+    FLOAT: lambda expected_output, tolerance: TokenComparator(
+        expected_output, DEFAULT_TOLERANCE if tolerance is None else tolerance
+    ),
+}
+
+
+def make_comparator(expected_output, mode=EXACT, tolerance=None):
+    """
+    Arguments:
+        expected_output: The expected output
+        mode: EXACT, TOKENS or FLOAT, a key of COMPARATORS
+        tolerance: The tolerance of the FLOAT mode
+
+    Returns:
+        A new Comparator for one run
+    """
+    return COMPARATORS[mode](expected_output, tolerance)
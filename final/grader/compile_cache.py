@@ -0,0 +1,144 @@
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from hashlib import sha256
+
+# Number of locks the sources are spread over, see CompileCache._lock()
+LOCK_STRIPES = 64
+
+
+class CompilationException(Exception):
+    pass
+
+
+class CompileCache:
+    """
+    Content-addressed cache of compiled C programs.
+
+    Binaries are keyed by the source bytes, the compiler version and the
+    flags, so resubmissions, duplicate uploads and regrades of an unchanged
+    source reuse the same binary. Binaries are written to a temporary file
+    and renamed into place, hits refresh their mtime, and the least recently
+    used binaries are removed once the cache grows past max_bytes.
+    """
+    def __init__(self, directory, compiler="gcc", flags=(), max_bytes=512 * 1024 * 1024, min_age=300):
+        """
+        Arguments:
+            directory: Where to keep the binaries
+            compiler: The compiler executable
+            flags: Extra compiler flags
+            max_bytes: The size the cache is trimmed to after a compilation
+            min_age: Binaries used in the last min_age seconds are never
+                evicted, so a test about to run one can't lose it
+        """
+        self.directory = directory
+        self.compiler = compiler
+        self.flags = list(flags)
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.compiler_version = None
+        # One source is compiled once per process at a time. A fixed set of
+        # locks, rather than one per source, doesn't grow with every source
+        # ever compiled, at the price of unrelated sources sometimes waiting
+        # for each other.
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def _compiler_version(self):
+        if self.compiler_version is None:
+            process = subprocess.run([self.compiler, "--version"], capture_output=True, text=True)
+            self.compiler_version = process.stdout.strip()
+        return self.compiler_version
+
+    def key(self, source):
+        header = "\0".join([self._compiler_version()] + self.flags) + "\0"
+        return sha256(header.encode() + source).hexdigest()
+
+    def _lock(self, key):
+        return self.locks[int(key, 16) % len(self.locks)]
+
+    def compile(self, source_path):
+        """
+        Compile a C source, or reuse the binary of an identical source
+
+        Arguments:
+            source_path: The path to the source
+
+        Returns:
+            (path to the binary, compile time in seconds), the compile time is 0
+            on a cache hit
+
+        Raises:
+            CompilationException: with the compiler's message if it fails
+        """
+        with open(source_path, "rb") as f:
+            source = f.read()
+        key = self.key(source)
+        binary_path = os.path.join(self.directory, key)
+
+        with self._lock(key):
+            if os.path.exists(binary_path):
+                try:
+                    os.utime(binary_path)
+                    return binary_path, 0
+                except FileNotFoundError:
+                    pass
+
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            os.close(fd)
+            try:
+                # Compile the bytes the key was computed from, the file may
+                # change in the meantime
+                with tempfile.TemporaryDirectory() as source_dir:
+                    snapshot_path = os.path.join(source_dir, os.path.basename(source_path))
+                    with open(snapshot_path, "wb") as f:
+                        f.write(source)
+
+                    compile_start_time = time.time()
+                    compile_process = subprocess.run(
+                        [self.compiler] + self.flags + [snapshot_path, "-o", tmp_path],
+                        capture_output=True,
+                        text=True,
+                    )
+                compile_time = time.time() - compile_start_time
+                if compile_process.returncode != 0:
+                    # Report the errors against the submitted file
+                    raise CompilationException(compile_process.stderr.replace(snapshot_path, source_path))
+
+                os.replace(tmp_path, binary_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        self.evict()
+        return binary_path, compile_time
+
+    def evict(self):
+        """
+        Remove the least recently used binaries until the cache fits in
+        max_bytes, sparing the ones used in the last min_age seconds
+        """
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+        entries.sort()
+        now = time.time()
+        for (mtime, size, path) in entries:
+            if total_size <= self.max_bytes or now - mtime < self.min_age:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
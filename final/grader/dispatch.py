@@ -0,0 +1,73 @@
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+
+class TestDispatcher:
+    """
+    Runs test cases on a shared executor with at most per_key of them per
+    problem at a time.
+
+    Test cases beyond a problem's limit wait in a queue of that problem and
+    are handed to the executor when one of its running test cases ends, so
+    the executor's threads only ever run test cases and a busy problem can't
+    hold them while other problems wait.
+    """
+    def __init__(self, executor, per_key):
+        """
+        Arguments:
+            executor: The Executor running the test cases of all problems
+            per_key: The number of test cases of one problem run at once
+        """
+        self.executor = executor
+        self.per_key = per_key
+        self.lock = threading.Lock()
+        # Key -> number of its test cases handed to the executor
+        self.running = {}
+        # Key -> deque of (future, function, arguments) waiting for a slot
+        self.waiting = {}
+
+    def submit(self, key, function, *args):
+        """
+        Run function(*args) once the problem key has a free slot
+
+        Returns:
+            A Future of its result
+        """
+        future = Future()
+        with self.lock:
+            if key in self.waiting:
+                self.waiting[key].append((future, function, args))
+            else:
+                self.waiting[key] = deque([(future, function, args)])
+        self._dispatch(key)
+        return future
+
+    def _dispatch(self, key):
+        ready = []
+        with self.lock:
+            queue = self.waiting.get(key)
+            while queue and self.running.get(key, 0) < self.per_key:
+                ready.append(queue.popleft())
+                self.running[key] = self.running.get(key, 0) + 1
+            if queue is not None and len(queue) == 0:
+                del self.waiting[key]
+
+        for item in ready:
+            self.executor.submit(self._run, key, *item)
+
+    def _run(self, key, future, function, args):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = function(*args)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        finally:
+            with self.lock:
+                self.running[key] -= 1
+                if self.running[key] == 0:
+                    del self.running[key]
+            self._dispatch(key)
@@ -0,0 +1,306 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+class QueueFullException(Exception):
+    pass
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """
+    Grading queue stored in SQLite and drained by a fixed pool of worker
+    threads. Jobs survive a restart: queued jobs stay queued, and a running
+    job is owned by the queue that claimed it through a lease that its
+    process renews while grading it. Once the lease of a job expires, because
+    its process exited or hung or couldn't record the outcome, any queue
+    takes it over. Live processes
+    sharing the database never take each other's jobs.
+    """
+    def __init__(self, db_path, grade, workers=2, max_pending=100, poll_interval=1.0, lease_duration=60.0):
+        """
+        Arguments:
+            db_path: The path of the SQLite database
+            grade: A function (problem number, script path) -> dict run by the
+                workers, its result must be JSON serializable
+            workers: The number of grader threads
+            max_pending: The maximum number of queued and running jobs,
+                submit() raises QueueFullException beyond this
+            poll_interval: How often idle workers check the database, in
+                seconds, for jobs added by other processes
+            lease_duration: How long a running job stays owned without its
+                lease being renewed, in seconds. Leases are renewed three
+                times per duration.
+        """
+        self.db_path = db_path
+        self.grade = grade
+        self.workers = workers
+        self.max_pending = max_pending
+        self.poll_interval = poll_interval
+        self.lease_duration = lease_duration
+        # Identifies the leases of this queue among the processes sharing
+        # the database
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.threads = []
+        # IDs of the jobs being graded by this queue, the only leases renewed
+        self.held = set()
+        self.held_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.wakeup = threading.Condition()
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    problem_number TEXT NOT NULL,
+                    script_path TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    owner TEXT,
+                    lease_until REAL
+                )
+                """
+            )
+            # Databases created before the leases
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            if "lease_until" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    @contextmanager
+    def _connect(self):
+        """
+        A connection that commits on success, rolls back on an exception and
+        is closed afterwards
+        """
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def start(self):
+        """
+        Start the workers and the renewal of their leases. Only the process
+        that grades should call it, e.g. not on import of the app. Calling it
+        again does nothing.
+        """
+        with self.start_lock:
+            if len(self.threads) > 0:
+                return
+
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"grader-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+            thread = threading.Thread(target=self._renew_leases, name="grader-leases", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, problem_number, script_path, save=None):
+        """
+        Queue a submission for grading
+
+        Arguments:
+            problem_number: The problem the submission is for
+            script_path: The path of the submission
+            save: A function called once the queue has room for the job and
+                before it is queued, e.g. to save the uploaded file, so a
+                rejected submission leaves nothing behind. If it raises the
+                job isn't queued.
+
+        Returns:
+            The job ID
+
+        Raises:
+            QueueFullException: if max_pending jobs are queued or running
+        """
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            (pending,) = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchone()
+            if pending >= self.max_pending:
+                raise QueueFullException(f"{pending} submissions are waiting to be graded")
+
+            if save is not None:
+                save()
+            conn.execute(
+                "INSERT INTO jobs (id, problem_number, script_path, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, str(problem_number), script_path, QUEUED, time.time()),
+            )
+
+        with self.wakeup:
+            self.wakeup.notify()
+        return job_id
+
+    def status(self, job_id):
+        """
+        Returns:
+            A dict describing the job, or None if there is no such job. Queued
+            jobs report their position in the queue, finished jobs their result.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+
+            job = {
+                "id": row["id"],
+                "problem_number": row["problem_number"],
+                "status": row["status"],
+                "created_at": row["created_at"],
+                "started_at": row["started_at"],
+                "finished_at": row["finished_at"],
+            }
+            if row["status"] == QUEUED:
+                (ahead,) = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?", (QUEUED, row["created_at"])
+                ).fetchone()
+                job["position"] = ahead + 1
+            elif row["status"] == DONE:
+                job["result"] = json.loads(row["result"])
+            elif row["status"] == FAILED:
+                job["error"] = row["error"]
+
+        return job
+
+    def _claim(self):
+        """
+        Atomically move the oldest queued job, or running job whose lease
+        expired, to running under a lease of this queue
+
+        Returns:
+            The job row, or None if there is no such job
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # A running job without a lease predates the leases
+            row = conn.execute(
+                """
+                SELECT * FROM jobs
+                WHERE status = ? OR (status = ? AND (lease_until IS NULL OR lease_until < ?))
+                ORDER BY created_at LIMIT 1
+                """,
+                (QUEUED, RUNNING, now),
+            ).fetchone()
+            if row is None:
+                return None
+
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, owner = ?, lease_until = ? WHERE id = ?",
+                (RUNNING, now, self.owner, now + self.lease_duration, row["id"]),
+            )
+            return row
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.lease_duration / 3)
+            with self.held_lock:
+                held = list(self.held)
+            if len(held) == 0:
+                continue
+
+            placeholders = ", ".join("?" * len(held))
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        f"UPDATE jobs SET lease_until = ? WHERE status = ? AND owner = ? AND id IN ({placeholders})",
+                        (time.time() + self.lease_duration, RUNNING, self.owner, *held),
+                    )
+            except sqlite3.Error:
+                # Retried on the next round, well before the leases expire
+                pass
+
+    def _finish(self, job_id, status, result=None, error=None):
+        # A job taken over after its lease expired belongs to the new owner
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL
+                WHERE id = ? AND owner = ?
+                """,
+                (status, result, error, time.time(), job_id, self.owner),
+            )
+
+    def _backoff(self, failures):
+        """
+        Returns:
+            How long to wait after a number of consecutive database errors,
+            in seconds
+        """
+        return min(self.poll_interval * 2 ** failures, self.lease_duration / 3)
+
+    def _work(self):
+        failures = 0
+        while True:
+            try:
+                job = self._claim()
+            except Exception:
+                # E.g. the database stayed locked past the timeout, the worker
+                # backs off and tries again instead of ending
+                failures += 1
+                time.sleep(self._backoff(failures))
+                continue
+
+            failures = 0
+            if job is None:
+                with self.wakeup:
+                    self.wakeup.wait(self.poll_interval)
+                continue
+
+            with self.held_lock:
+                self.held.add(job["id"])
+            try:
+                self._grade(job)
+            finally:
+                # A job that couldn't be finished is no longer renewed, once
+                # its lease expires it is graded again
+                with self.held_lock:
+                    self.held.discard(job["id"])
+
+    def _grade(self, job, attempts=3):
+        """
+        Grade a claimed job and record its outcome, retrying the database a
+        few times
+
+        Returns:
+            Whether the outcome was recorded
+        """
+        try:
+            result = json.dumps(self.grade(job["problem_number"], job["script_path"]))
+            status, error = DONE, None
+        except Exception as e:
+            result, status, error = None, FAILED, f"{type(e).__name__}: {e}"
+
+        for attempt in range(attempts):
+            try:
+                self._finish(job["id"], status, result=result, error=error)
+                return True
+            except Exception:
+                if attempt + 1 < attempts:
+                    time.sleep(self._backoff(attempt + 1))
+        return False
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+from grader.compare import COMPARATORS, EXACT
+from grader.sandbox import Limits
+
+# One test case of a problem, the input is fed to the program as is and the
+# expected output is stripped like the program's output is
+TestCase = namedtuple("TestCase", ["index", "input", "expected_output", "difficulty", "marks"])
+
+# Everything needed to grade a submission of a problem
+ProblemBundle = namedtuple(
+    "ProblemBundle", ["problem_number", "test_cases", "total_marks", "limits", "checker", "signature"]
+)
+
+
+def _test_order(index):
+    return (not index.isdigit(), int(index) if index.isdigit() else 0, index)
+
+
+def _read_limits(test_case_dir, default_limits):
+    """
+    Read the optional limits.txt of a problem, one "name value" per line with
+    the names of default_limits. Missing values fall back to the defaults.
+    """
+    limits = dict(default_limits)
+    limits_path = os.path.join(test_case_dir, "limits.txt")
+    if os.path.exists(limits_path):
+        with open(limits_path, "r") as limits_file:
+            for line in limits_file:
+                if line.strip():
+                    name, value = line.split()
+                    if name in limits:
+                        limits[name] = float(value)
+    return Limits(**limits)
+
+
+def _read_checker(test_case_dir):
+    """
+    Read the optional checker.txt of a problem, a line "mode [tolerance]"
+    with a mode of grader.compare, e.g. "tokens" or "float 1e-4". Outputs are
+    compared exactly without it.
+
+    Returns:
+        (mode, tolerance), the tolerance is None if not given
+    """
+    checker_path = os.path.join(test_case_dir, "checker.txt")
+    if not os.path.exists(checker_path):
+        return (EXACT, None)
+
+    with open(checker_path, "r") as checker_file:
+        fields = checker_file.read().split()
+    if len(fields) == 0:
+        return (EXACT, None)
+    if fields[0] not in COMPARATORS:
+        raise ValueError(f"Unknown checker {fields[0]} in {checker_path}")
+    return (fields[0], float(fields[1]) if len(fields) > 1 else None)
+
+
+def _signature(test_case_dir):
+    """
+    Returns:
+        The (path, mtime, size) of every test data file of a problem, it
+        changes whenever a file is written, added or removed
+    """
+    files = []
+    paths = [os.path.join(test_case_dir, "limits.txt"), os.path.join(test_case_dir, "checker.txt")]
+    for name in ["inputs", "outputs", "metadata"]:
+        directory = os.path.join(test_case_dir, name)
+        if os.path.exists(directory):
+            paths.extend(os.path.join(directory, filename) for filename in os.listdir(directory))
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        files.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(files)
+
+
+def load_problem(test_case_dir, problem_number, default_limits):
+    """
+    Read the test cases of a problem
+
+    Arguments:
+        test_case_dir: The directory of the problem
+        problem_number: The problem number
+        default_limits: A dict of Limits arguments, limits.txt overrides them
+
+    Returns:
+        A ProblemBundle
+    """
+    input_dir = os.path.join(test_case_dir, "inputs")
+    output_dir = os.path.join(test_case_dir, "outputs")
+    metadata_dir = os.path.join(test_case_dir, "metadata")
+
+    # Taken first, so a write during the load makes the bundle stale instead
+    # of being missed
+    signature = _signature(test_case_dir)
+
+    test_indices = [
+        input_file.replace("input", "").replace(".txt", "")
+        for input_file in os.listdir(input_dir)
+        if input_file.startswith("input") and input_file.endswith(".txt")
+    ]
+    test_indices.sort(key=_test_order)
+
+    test_cases = []
+    total_marks = 0
+    for test_index in test_indices:
+        with open(os.path.join(input_dir, f"input{test_index}.txt"), "rb") as inp:
+            input_data = inp.read()
+        with open(os.path.join(output_dir, f"output{test_index}.txt"), "r") as out:
+            expected_output = out.read().strip()
+        with open(os.path.join(metadata_dir, f"metadata{test_index}.txt"), "r") as meta:
+            difficulty, marks = meta.read().strip().split("\n")
+            marks = int(marks)
+
+        total_marks += marks
+        test_cases.append(TestCase(test_index, input_data, expected_output, difficulty, marks))
+
+    return ProblemBundle(
+        str(problem_number),
+        tuple(test_cases),
+        total_marks,
+        _read_limits(test_case_dir, default_limits),
+        _read_checker(test_case_dir),
+        signature,
+    )
+
+
+class ProblemStore:
+    """
+    In-memory cache of ProblemBundles shared by all graders.
+
+    A bundle is loaded on first use and then served from memory. Writes made
+    through the app call invalidate(), edits made by hand are noticed by
+    comparing the mtimes of the test data, at most once per check_interval
+    seconds, so a busy problem doesn't touch the filesystem per submission.
+    """
+    def __init__(self, problems_folder, default_limits, check_interval=5.0):
+        """
+        Arguments:
+            problems_folder: The directory holding the problemN directories
+            default_limits: A dict of Limits arguments, limits.txt overrides them
+            check_interval: Seconds between two mtime checks of a bundle
+        """
+        self.problems_folder = problems_folder
+        self.default_limits = default_limits
+        self.check_interval = check_interval
+        # Problem number -> (bundle, time of the last mtime check)
+        self.bundles = {}
+        self.lock = threading.Lock()
+
+    def _directory(self, problem_number):
+        return os.path.join(self.problems_folder, f"problem{problem_number}")
+
+    def get(self, problem_number):
+        """
+        Returns:
+            The ProblemBundle of a problem, loading it if needed
+        """
+        problem_number = str(problem_number)
+        with self.lock:
+            now = time.monotonic()
+            if problem_number in self.bundles:
+                bundle, checked_at = self.bundles[problem_number]
+                if now - checked_at < self.check_interval:
+                    return bundle
+                if _signature(self._directory(problem_number)) == bundle.signature:
+                    self.bundles[problem_number] = (bundle, now)
+                    return bundle
+
+            bundle = load_problem(self._directory(problem_number), problem_number, self.default_limits)
+            self.bundles[problem_number] = (bundle, now)
+            return bundle
+
+    def invalidate(self, problem_number):
+        """
+        Drop the bundle of a problem, the next get() reloads it
+        """
+        with self.lock:
+            self.bundles.pop(str(problem_number), None)
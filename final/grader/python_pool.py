@@ -0,0 +1,148 @@
+import json
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+from grader.sandbox import supervise
+
+ZYGOTE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zygote.py")
+
+
+def resolve_python(names=("python", "python3")):
+    """
+    Find the interpreter submissions run with, once. Wrappers like pyenv
+    shims are resolved to the real executable, so a test case doesn't pay
+    for them.
+
+    Arguments:
+        names: The executable names to look for, in order of preference
+
+    Returns:
+        The path of the first of them that runs, or the interpreter running
+        the app if none does
+    """
+    for name in names:
+        path = shutil.which(name)
+        if path is None:
+            continue
+        try:
+            process = subprocess.run([path, "-c", "import sys; print(sys.executable)"], capture_output=True, text=True)
+        except OSError:
+            continue
+        executable = process.stdout.strip()
+        if process.returncode == 0 and len(executable) > 0:
+            return executable
+    return sys.executable
+
+
+class Zygote:
+    """
+    A warm interpreter of the pool, see zygote.py
+    """
+    def __init__(self, python):
+        self.sock, zygote_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.process = subprocess.Popen(
+            [python, ZYGOTE_PATH, str(zygote_end.fileno())],
+            pass_fds=[zygote_end.fileno()],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        zygote_end.close()
+        self.replies = self.sock.makefile("rb")
+
+    def reply(self):
+        line = self.replies.readline()
+        if len(line) == 0:
+            raise ConnectionError("The warm interpreter exited")
+        return json.loads(line)
+
+    def close(self):
+        self.replies.close()
+        self.sock.close()
+        self.process.kill()
+        self.process.wait()
+
+
+class PythonPool:
+    """
+    Pool of warm Python interpreters running submissions.
+
+    Each interpreter forks a child per run, which sets the limits, starts a
+    new session and runs the script as __main__ with the test input on its
+    stdin, so runs share nothing but the interpreter's startup. A run is
+    supervised exactly like one started by run_limited(), it only skips the
+    exec and the interpreter startup.
+    """
+    def __init__(self, python, size):
+        """
+        Arguments:
+            python: The interpreter executable, see resolve_python()
+            size: The number of warm interpreters, runs beyond it wait for a
+                free one
+        """
+        self.python = python
+        self.size = size
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(Zygote(python))
+
+    def run(self, script_path, input_data, limits, output=None):
+        """
+        Run a Python script in a warm interpreter, the arguments and the
+        result are those of run_limited()
+        """
+        zygote = self.idle.get()
+        if zygote is None:
+            # Replacing a broken interpreter failed before, try again
+            try:
+                zygote = Zygote(self.python)
+            except BaseException:
+                self.idle.put(None)
+                raise
+
+        try:
+            stdin_read, stdin_write = os.pipe()
+            stdout_read, stdout_write = os.pipe()
+            stdin = open(stdin_write, "wb")
+            stdout = open(stdout_read, "rb")
+            request = {"script": script_path, "rlimits": limits.rlimits()}
+
+            start_time = time.monotonic()
+            try:
+                socket.send_fds(zygote.sock, [json.dumps(request).encode()], [stdin_read, stdout_write])
+            finally:
+                os.close(stdin_read)
+                os.close(stdout_write)
+
+            try:
+                pid = zygote.reply()["pid"]
+            except BaseException:
+                stdin.close()
+                stdout.close()
+                raise
+
+            def wait():
+                reply = zygote.reply()
+                return reply["wait_status"], reply["cpu_time"]
+
+            return supervise(pid, stdin, stdout, wait, input_data, limits, output, start_time)
+        except (OSError, ValueError):
+            # The interpreter is in an unknown state, replace it. If that
+            # fails too its slot stays empty until the next run.
+            zygote.close()
+            zygote = None
+            zygote = Zygote(self.python)
+            raise
+        finally:
+            self.idle.put(zygote)
+
+    def close(self):
+        for _ in range(self.size):
+            zygote = self.idle.get()
+            if zygote is not None:
+                zygote.close()
@@ -0,0 +1,59 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Columns of the CSV score table, the JSON table also keeps the test results
+SCORE_COLUMNS = ["submission", "obtained_marks", "total_marks", "compile_time", "message"]
+
+
+def regrade(problem_number, script_paths, grade, workers=2):
+    """
+    Grade many submissions of a problem at once
+
+    Arguments:
+        problem_number: The problem the submissions belong to
+        script_paths: The paths of the submissions
+        grade: A function (problem number, script path) -> dict, the same one
+            the job queue runs
+        workers: The number of submissions graded at once
+
+    Returns:
+        (a list of score rows in the order of script_paths, elapsed seconds)
+    """
+    def grade_one(script_path):
+        try:
+            result = grade(problem_number, script_path)
+        except Exception as e:
+            result = {"message": f"{type(e).__name__}: {e}"}
+        row = {"submission": os.path.basename(script_path)}
+        row.update(result)
+        return row
+
+    start_time = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        rows = list(executor.map(grade_one, script_paths))
+    return rows, time.monotonic() - start_time
+
+
+def write_scores(rows, csv_path, json_path):
+    """
+    Write a score table as CSV and as JSON
+
+    Arguments:
+        rows: The score rows returned by regrade()
+        csv_path: Where to write the CSV table, one line per submission
+        json_path: Where to write the JSON table, including the test results
+    """
+    os.makedirs(os.path.dirname(csv_path) or ".", exist_ok=True)
+    os.makedirs(os.path.dirname(json_path) or ".", exist_ok=True)
+
+    with open(csv_path, "w", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=SCORE_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+    with open(json_path, "w") as json_file:
+        json.dump(rows, json_file, indent=4)
@@ -0,0 +1,289 @@
+import os
+import resource
+import signal
+import subprocess
+import threading
+import time
+
+OK = "OK"
+TIME_LIMIT_EXCEEDED = "TLE"
+RUNTIME_ERROR = "RE"
+OUTPUT_LIMIT_EXCEEDED = "OLE"
+WRONG_ANSWER = "WA"
+
+# How often the resident set size of a running program is sampled, in seconds
+RSS_SAMPLE_INTERVAL = 0.005
+# Size of the stdout reads
+READ_CHUNK_SIZE = 64 * 1024
+# Sets the limits of a program and execs it, see Limits.launcher()
+LAUNCHER_SHELL = "/bin/sh"
+# rlimit -> (ulimit flag, bytes per unit of the flag)
+ULIMIT_FLAGS = {
+    resource.RLIMIT_CPU: ("-t", 1),
+    resource.RLIMIT_AS: ("-v", 1024),
+    resource.RLIMIT_CORE: ("-c", 512),
+}
+
+
+class Limits:
+    def __init__(self, wall_time=None, cpu_time=None, memory_mb=None, output_mb=None):
+        """
+        Arguments:
+            wall_time: Wall-clock limit in seconds, None for no limit
+            cpu_time: CPU time limit in seconds, None for no limit
+            memory_mb: Address space limit in MiB, None for no limit
+            output_mb: Limit of the standard output in MiB, None for no limit
+        """
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.memory_mb = memory_mb
+        self.output_mb = output_mb
+
+    def rlimits(self):
+        """
+        Returns:
+            A list of (resource, (soft limit, hard limit)) to set in the
+            program's process
+        """
+        rlimits = []
+        if self.cpu_time is not None:
+            seconds = max(1, int(self.cpu_time + 0.999))
+            # SIGXCPU at the soft limit, SIGKILL one second later
+            rlimits.append((resource.RLIMIT_CPU, (seconds, seconds + 1)))
+        if self.memory_mb is not None:
+            size = int(self.memory_mb * 1024 * 1024)
+            rlimits.append((resource.RLIMIT_AS, (size, size)))
+        rlimits.append((resource.RLIMIT_CORE, (0, 0)))
+        return rlimits
+
+    def launcher(self, command):
+        """
+        Setting the rlimits between fork and exec with preexec_fn isn't safe
+        in a process running threads, so a shell sets them with ulimit and
+        execs the program in its place. A limit that can't be set fails the
+        run instead of leaving the program unlimited.
+
+        Arguments:
+            command: The command line of the program as a list
+
+        Returns:
+            The command line running the program under the rlimits
+        """
+        steps = []
+        for (limit, (soft, hard)) in self.rlimits():
+            flag, unit = ULIMIT_FLAGS[limit]
+            # The soft limit first, it can't exceed the hard one
+            steps.append(f"ulimit -S {flag} {soft // unit}")
+            steps.append(f"ulimit -H {flag} {hard // unit}")
+        steps.append('exec "$@"')
+        return [LAUNCHER_SHELL, "-c", " && ".join(steps), "launcher"] + list(command)
+
+
+class RunResult:
+    def __init__(self, stdout, returncode, status, wall_time, cpu_time, peak_rss_kb):
+        self.stdout = stdout
+        self.returncode = returncode
+        self.status = status
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.peak_rss_kb = peak_rss_kb
+
+
+def read_peak_rss_kb(pid, launcher_exe=None):
+    """
+    Arguments:
+        pid: The process ID
+        launcher_exe: The executable the process runs before it execs the
+            program, its samples are skipped. None to take every sample.
+
+    Returns:
+        The peak resident set size of a running process in KiB, None if it
+        is not available or the process didn't exec the program yet
+    """
+    try:
+        if launcher_exe is not None and os.readlink(f"/proc/{pid}/exe") == launcher_exe:
+            return None
+        with open(f"/proc/{pid}/status", "r") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def run_limited(command, input_data, limits, output=None):
+    """
+    Run a command under the given limits and measure it
+
+    Arguments:
+        command: The command line as a list
+        input_data: The bytes fed to the standard input
+        limits: The Limits of the run
+        output: An object whose feed() is called with each chunk of the
+            standard output as it arrives, e.g. a Comparator. When feed()
+            returns True the program is killed, the rest of its output isn't
+            needed. If None the output is collected into the stdout of the
+            result.
+
+    Returns:
+        A RunResult. The status is TLE when a time limit was hit, OLE when the
+        output limit was hit, WA when output.feed() stopped the program and
+        RE when the program exited with a non-zero code or was killed by a
+        signal. stdout is None if output was given.
+    """
+    start_time = time.monotonic()
+    process = subprocess.Popen(
+        limits.launcher(command),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+    def wait():
+        # Reap the child ourselves to get its resource usage
+        _, wait_status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(wait_status)
+        return wait_status, usage.ru_utime + usage.ru_stime
+
+    launcher_exe = os.path.realpath(LAUNCHER_SHELL)
+    return supervise(process.pid, process.stdin, process.stdout, wait, input_data, limits, output, start_time, launcher_exe)
+
+
+def supervise(pid, stdin, stdout, wait, input_data, limits, output, start_time, launcher_exe=None):
+    """
+    Feed, drain, measure and enforce the limits of a started program. The
+    program must lead its own process group, so it can be killed with all
+    its children.
+
+    Arguments:
+        pid: The process ID of the program
+        stdin: A binary file object writing to the program's standard input
+        stdout: A binary file object reading the program's standard output
+        wait: A function blocking until the program exits, returning its
+            (wait status, CPU time in seconds)
+        input_data, limits, output: As for run_limited()
+        start_time: The time.monotonic() the program was started at
+        launcher_exe: The executable that execs the program, if any, see
+            read_peak_rss_kb()
+
+    Returns:
+        A RunResult, as for run_limited()
+    """
+    timed_out = threading.Event()
+    def kill_group():
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def kill():
+        timed_out.set()
+        kill_group()
+
+    chunks = []
+    feed = output.feed if output is not None else chunks.append
+    max_output_bytes = None
+    if limits.output_mb is not None:
+        max_output_bytes = int(limits.output_mb * 1024 * 1024)
+    output_exceeded = threading.Event()
+    output_rejected = threading.Event()
+
+    # Drain stdout in the background so a chatty program can't block on a
+    # full pipe while we wait for it. Past the output limit, or once the
+    # output can't be right anymore, the program is killed instead of reading
+    # any more of it.
+    def read_output():
+        output_bytes = 0
+        while True:
+            chunk = stdout.read1(READ_CHUNK_SIZE)
+            if len(chunk) == 0:
+                break
+            output_bytes += len(chunk)
+            if max_output_bytes is not None and output_bytes > max_output_bytes:
+                output_exceeded.set()
+                kill_group()
+                break
+            if feed(chunk):
+                output_rejected.set()
+                kill_group()
+                break
+
+    reader = threading.Thread(target=read_output, daemon=True)
+    reader.start()
+
+    # Likewise feed stdin in the background, a program that never reads it
+    # mustn't block us
+    def write_input():
+        try:
+            stdin.write(input_data)
+            stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+    writer = threading.Thread(target=write_input, daemon=True)
+    writer.start()
+
+    # ru_maxrss of the child would include the memory of this process it was
+    # forked from, so sample the high-water mark of the program itself. The
+    # launcher's samples are skipped, exec resets the mark. A program forked
+    # from a warm interpreter counts that interpreter, as it would count its
+    # own when started fresh. A program exiting before its first sample has
+    # no peak, rather than a made up one.
+    peak_rss_kb = [None]
+    exited = threading.Event()
+    def sample_rss():
+        while True:
+            sample = read_peak_rss_kb(pid, launcher_exe)
+            if sample is not None:
+                peak_rss_kb[0] = max(peak_rss_kb[0] or 0, sample)
+            if exited.wait(RSS_SAMPLE_INTERVAL):
+                break
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+
+    timer = None
+    if limits.wall_time is not None:
+        timer = threading.Timer(limits.wall_time, kill)
+        timer.start()
+
+    try:
+        wait_status, cpu_time = wait()
+        wall_time = time.monotonic() - start_time
+    finally:
+        # Also when waiting failed, e.g. the warm interpreter that started the
+        # program died, so nothing outlives this call: the timer can't kill a
+        # reused process group later and the helper threads end
+        exited.set()
+        if timer is not None:
+            timer.cancel()
+        # Leftover children of the program would keep stdout open
+        kill_group()
+        reader.join()
+        writer.join()
+        sampler.join()
+        stdout.close()
+    returncode = os.waitstatus_to_exitcode(wait_status)
+
+    output_text = None
+    if output is None:
+        output_text = b"".join(chunks).decode(errors="replace").replace("\r\n", "\n")
+
+    if (
+        timed_out.is_set()
+        or returncode == -signal.SIGXCPU
+        or (limits.cpu_time is not None and cpu_time > limits.cpu_time)
+    ):
+        status = TIME_LIMIT_EXCEEDED
+    elif output_exceeded.is_set():
+        status = OUTPUT_LIMIT_EXCEEDED
+    elif output_rejected.is_set():
+        status = WRONG_ANSWER
+    elif returncode != 0:
+        status = RUNTIME_ERROR
+    else:
+        status = OK
+
+    return RunResult(output_text, returncode, status, wall_time, cpu_time, peak_rss_kb[0])
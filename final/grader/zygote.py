@@ -0,0 +1,117 @@
+"""
+A warm Python interpreter that forks a fresh child per submission run.
+
+Started by PythonPool with the end of a Unix socket as its only argument. Each
+request is a JSON line carrying the script path and the rlimits to set, sent
+together with the read end of the program's stdin and the write end of its
+stdout. The interpreter answers with the child's PID once it is forked and
+with its wait status and CPU time once it exits. It only uses the standard
+library, it runs under the interpreter submissions are graded with.
+"""
+import atexit
+import json
+import os
+import resource
+import socket
+import sys
+import traceback
+import types
+
+# Imported once here instead of by every submission
+import bisect
+import collections
+import functools
+import heapq
+import itertools
+import math
+import re
+import string
+
+# Large enough for any request, the paths are short
+MAX_REQUEST_SIZE = 64 * 1024
+
+
+def run_child(request, stdin_fd, stdout_fd):
+    """
+    Turn the forked child into the program and run it. Never returns.
+    """
+    try:
+        os.setsid()
+        for (limit, values) in request["rlimits"]:
+            resource.setrlimit(limit, tuple(values))
+
+        os.dup2(stdin_fd, 0)
+        os.dup2(stdout_fd, 1)
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 2)
+        # Everything else, like the socket to the pool, stays out of reach
+        os.closerange(3, os.sysconf("SC_OPEN_MAX"))
+
+        sys.stdin = open(0, "r", closefd=False)
+        sys.stdout = open(1, "w", closefd=False)
+        sys.stderr = open(2, "w", closefd=False)
+
+        script_path = request["script"]
+        sys.argv = [script_path]
+        sys.path[0] = os.path.dirname(os.path.abspath(script_path))
+        main = types.ModuleType("__main__")
+        main.__file__ = script_path
+        sys.modules["__main__"] = main
+    except BaseException:
+        os._exit(1)
+
+    # Like runpy.run_path(), without importing what it needs in every child
+    exit_code = 0
+    try:
+        with open(script_path, "rb") as script:
+            code = compile(script.read(), script_path, "exec")
+        exec(code, main.__dict__)
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+
+    try:
+        # Wait for non-daemon threads like the interpreter does at exit
+        if "threading" in sys.modules:
+            sys.modules["threading"]._shutdown()
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+    except BaseException:
+        exit_code = exit_code or 1
+    os._exit(exit_code & 0xFF)
+
+
+def serve(sock):
+    replies = sock.makefile("wb")
+    while True:
+        message, fds, _, _ = socket.recv_fds(sock, MAX_REQUEST_SIZE, 2)
+        if len(message) == 0:
+            return
+        request = json.loads(message)
+        stdin_fd, stdout_fd = fds
+
+        pid = os.fork()
+        if pid == 0:
+            run_child(request, stdin_fd, stdout_fd)
+
+        os.close(stdin_fd)
+        os.close(stdout_fd)
+        replies.write(json.dumps({"pid": pid}).encode() + b"\n")
+        replies.flush()
+
+        _, wait_status, usage = os.wait4(pid, 0)
+        reply = {"wait_status": wait_status, "cpu_time": usage.ru_utime + usage.ru_stime}
+        replies.write(json.dumps(reply).encode() + b"\n")
+        replies.flush()
+
+
+if __name__ == "__main__":
+    serve(socket.socket(fileno=int(sys.argv[1])))
@@ -1,4 +1,5 @@
-from hashlib import sha256
+from array import array
+from hashlib import blake2b, sha256
 
 
 class ASTGenerationException(Exception):
@@ -7,6 +8,59 @@ class ASTSearchException(Exception):
     pass
 
 
+# Fingerprinting modes for AST.hash_non_recursive()
+class Sha256Fingerprints:
+    """
+    SHA-256 hex digest of the kind concatenated with the children's digests
+    """
+    def fingerprint(self, kind, child_fingerprints):
+        return sha256((kind + "".join(child_fingerprints)).encode()).hexdigest()
+
+
+class InternedFingerprints:
+    """
+    Interns (kind, child fingerprint ids...) tuples into a table and returns
+    small integer ids. Two subtrees get the same id exactly when their
+    structure is the same, but ids are only meaningful within one table, so
+    they cannot be compared across processes or stored.
+    """
+    def __init__(self):
+        self.table = {}
+
+    def fingerprint(self, kind, child_fingerprints):
+        key = (kind, *child_fingerprints)
+        fingerprint = self.table.get(key)
+        if fingerprint is None:
+            fingerprint = len(self.table)
+            self.table[key] = fingerprint
+        return fingerprint
+
+    def __len__(self):
+        return len(self.table)
+
+
+class Hash64Fingerprints:
+    """
+    64-bit BLAKE2b hash of the kind and the children's 64-bit fingerprints.
+    Stable across processes, so it is safe for worker processes and the
+    on-disk cache.
+    """
+    def __init__(self):
+        self.kinds = {}
+
+    def fingerprint(self, kind, child_fingerprints):
+        prefix = self.kinds.get(kind)
+        if prefix is None:
+            prefix = kind.encode() + b"\0"
+            self.kinds[kind] = prefix
+        digest = blake2b(prefix + array("Q", child_fingerprints).tobytes(), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+
+SHA256_FINGERPRINTS = Sha256Fingerprints()
+HASH64_FINGERPRINTS = Hash64Fingerprints()
+
+
 # Base class for Abstract Syntax Trees
 class AST:
     def __init__(self, parent=None, name=None, text=None, start_pos=None, end_pos=None, kind=None):
@@ -34,35 +88,28 @@ class AST:
 
         return self.fingerprint
 
-    def hash_non_recursive(self):
+    def hash_non_recursive(self, fingerprints=SHA256_FINGERPRINTS):
         """
         Equivalent to hash() but non-recursive
-        """
-        stack = [(self, iter(self.children))]
-
-        while len(stack) > 0:
-            (curr_node, curr_node_children_iter) = stack[-1]
 
-            try:
-                child_node = next(curr_node_children_iter)
-                stack.append((child_node, iter(child_node.children)))
-            except StopIteration:
-                child_fingerprints = "".join(c.fingerprint for c in curr_node.children)
-                curr_node.fingerprint = sha256(
-                    (curr_node.kind + child_fingerprints).encode()
-                ).hexdigest()
-                stack.pop()
+        Arguments:
+            fingerprints: The fingerprinting mode, one of Sha256Fingerprints,
+                InternedFingerprints or Hash64Fingerprints
+        """
+        for node in self.iter_postorder():
+            node.fingerprint = fingerprints.fingerprint(
+                node.kind, [c.fingerprint for c in node.children]
+            )
 
     def display(self, level=0):
         """
-        Recursively print out the entire tree structure
+        Print out the entire tree structure
 
         Arguments:
             level: The level of this node(for indentation purpose)
         """
-        print("    " * level + str(self))
-        for child in self.children:
-            child.display(level + 1)
+        for (node, depth) in self.iter_levels():
+            print("    " * (level + depth) + str(node))
 
     def __str__(self):
         return f"<{self.name}, {self.start_pos}-{self.end_pos}, {self.kind}, {self.weight}>"
@@ -70,6 +117,59 @@ class AST:
     def __repr__(self):
         return str(self)
 
+    def iter_levels(self, max_depth=None):
+        """
+        Iterative preorder traversal of this tree along with the depth of
+        each node
+
+        Arguments:
+            max_depth: Don't descend below this depth(this node is at depth 0),
+                None for no limit
+
+        Yields:
+            (node, depth) in preorder
+        """
+        stack = [(self, 0)]
+        while len(stack) > 0:
+            (node, depth) = stack.pop()
+            yield node, depth
+
+            if max_depth is None or depth < max_depth:
+                stack.extend((child, depth + 1) for child in reversed(node.children))
+
+    def iter_preorder(self, max_depth=None):
+        """
+        Iterative preorder traversal of this tree
+
+        Arguments:
+            max_depth: Don't descend below this depth(this node is at depth 0),
+                None for no limit
+
+        Yields:
+            The nodes in preorder
+        """
+        for (node, _) in self.iter_levels(max_depth):
+            yield node
+
+    def iter_postorder(self):
+        """
+        Iterative postorder traversal of this tree
+
+        Yields:
+            The nodes in postorder
+        """
+        stack = [(self, iter(self.children))]
+
+        while len(stack) > 0:
+            (curr_node, curr_node_children_iter) = stack[-1]
+
+            child_node = next(curr_node_children_iter, None)
+            if child_node is not None:
+                stack.append((child_node, iter(child_node.children)))
+            else:
+                stack.pop()
+                yield curr_node
+
     def preorder(self):
         """
         The preorder traversal of this tree
@@ -77,26 +177,14 @@ class AST:
         Returns:
             A list of nodes in preorder
         """
-        lst = [self]
-        for child in self.children:
-            lst += child.preorder()
-        return lst
+        return list(self.iter_preorder())
 
     def subtree(self, kind, name):
-        def get_subtree_root(root, kind, name):
-            if root.kind == kind and root.name == name:
-                return root
-
-            for child in root.children:
-                child_result = get_subtree_root(child, kind, name)
-                if child_result is not None:
-                    return child_result
-
-        subtree_root = get_subtree_root(self, kind, name)
-        if subtree_root is None:
-            raise ASTSearchException("Cannot find specified kind and identifier name")
+        for node in self.iter_preorder():
+            if node.kind == kind and node.name == name:
+                return node
 
-        return subtree_root
+        raise ASTSearchException("Cannot find specified kind and identifier name")
 
     @classmethod
     def create(cls, path, **kwargs):
@@ -108,4 +196,173 @@ class AST:
             path: The path to the program
             **kwargs: Additional resources needed to create an AST
         """
-        raise NotImplementedError("This method should be overrided in the child class")
\ No newline at end of file
+        raise NotImplementedError("This method should be overrided in the child class")
+
+    @classmethod
+    def create_compact(cls, path, fingerprints=SHA256_FINGERPRINTS, **kwargs):
+        """
+        Create the hashed CompactAST of the program pointed by the path. By
+        default this builds the full AST first, child classes may override it
+        with a single pass over the parse tree.
+
+        Parameters:
+            path: The path to the program
+            fingerprints: The fingerprinting mode
+            **kwargs: Additional resources needed to create an AST
+        """
+        ast = cls.create(path, **kwargs)
+        ast.hash_non_recursive(fingerprints)
+        return CompactAST.from_ast(ast)
+
+
+# Compact, picklable form of a hashed AST
+class CompactAST:
+    def __init__(self, weights=None, fingerprints=None, positions=None, names=None):
+        # Parallel arrays indexed by the preorder position of each node. The
+        # subtree of node i spans [i, i + weights[i]) since a node's weight is
+        # the size of its subtree.
+        self.weights = weights if weights is not None else array("i")
+        self.fingerprints = fingerprints if fingerprints is not None else []
+        # Start row, start column, end row, end column of each node
+        self.positions = positions if positions is not None else tuple(array("i") for _ in range(4))
+        # Preorder position -> (kind, name) for the named nodes only
+        self.names = names if names is not None else {}
+
+    def __len__(self):
+        return len(self.weights)
+
+    def start_pos(self, i):
+        return (self.positions[0][i], self.positions[1][i])
+
+    def end_pos(self, i):
+        return (self.positions[2][i], self.positions[3][i])
+
+    @classmethod
+    def from_ast(cls, ast):
+        """
+        Flatten a hashed AST into preorder records
+
+        Arguments:
+            ast: The root of an AST on which hash_non_recursive() was called
+
+        Returns:
+            The CompactAST of the tree
+        """
+        compact = cls()
+        start_rows, start_cols, end_rows, end_cols = compact.positions
+        for node in ast.iter_preorder():
+            if node.name:
+                compact.names[len(compact.weights)] = (node.kind, node.name)
+            compact.weights.append(node.weight)
+            compact.fingerprints.append(node.fingerprint)
+            start_rows.append(node.start_pos[0])
+            start_cols.append(node.start_pos[1])
+            end_rows.append(node.end_pos[0])
+            end_cols.append(node.end_pos[1])
+
+        # Integer fingerprints fit in a 64-bit array
+        if isinstance(compact.fingerprints[0], int):
+            compact.fingerprints = array("Q", compact.fingerprints)
+
+        return compact
+
+    @classmethod
+    def from_cursor(cls, cursor, fingerprints=SHA256_FINGERPRINTS, ignore_kinds=(), name_getters=None):
+        """
+        Build the hashed CompactAST straight from a tree-sitter cursor in a
+        single pass, without creating AST nodes or copying the source text.
+        Records are emitted in preorder and each node's weight and
+        fingerprint are filled in once the walk leaves it(postorder).
+
+        Arguments:
+            cursor: A tree-sitter TreeCursor at the root node
+            fingerprints: The fingerprinting mode
+            ignore_kinds: The kinds of the nodes to leave out with their subtrees
+            name_getters: A dict mapping a kind to a function that returns the
+                name of a tree-sitter node of that kind
+
+        Returns:
+            The CompactAST of the tree, equivalent to from_ast() on the AST
+        """
+        name_getters = name_getters if name_getters is not None else {}
+        compact = cls()
+        weights = compact.weights
+        fingerprint_list = []
+        start_rows, start_cols, end_rows, end_cols = compact.positions
+
+        # (preorder position, kind, children's fingerprints) of the nodes
+        # from the root down to the current one
+        stack = []
+
+        def enter(node):
+            kind = node.type
+            i = len(weights)
+            if kind in name_getters:
+                name = name_getters[kind](node)
+                if name:
+                    compact.names[i] = (kind, name)
+            weights.append(0)
+            fingerprint_list.append(None)
+            start_rows.append(node.start_point[0])
+            start_cols.append(node.start_point[1])
+            end_rows.append(node.end_point[0])
+            end_cols.append(node.end_point[1])
+            stack.append((i, kind, []))
+
+        enter(cursor.node)
+        at_child = cursor.goto_first_child()
+        while True:
+            if at_child:
+                if cursor.node.type in ignore_kinds:
+                    at_child = cursor.goto_next_sibling()
+                    if not at_child:
+                        cursor.goto_parent()
+                    continue
+
+                enter(cursor.node)
+                at_child = cursor.goto_first_child()
+                continue
+
+            # The cursor is at the node on top of the stack and all of its
+            # children are done
+            (i, kind, child_fingerprints) = stack.pop()
+            weights[i] = len(weights) - i
+            fingerprint = fingerprints.fingerprint(kind, child_fingerprints)
+            fingerprint_list[i] = fingerprint
+            if len(stack) == 0:
+                break
+            stack[-1][2].append(fingerprint)
+
+            at_child = cursor.goto_next_sibling()
+            if not at_child:
+                cursor.goto_parent()
+
+        # Integer fingerprints fit in a 64-bit array
+        if isinstance(fingerprint_list[0], int):
+            compact.fingerprints = array("Q", fingerprint_list)
+        else:
+            compact.fingerprints = fingerprint_list
+
+        return compact
+
+    def subtree(self, kind, name):
+        """
+        Equivalent to AST.subtree() on the compact form
+
+        Returns:
+            A CompactAST of the first subtree in preorder with the specified
+            kind and identifier name
+        """
+        for i, (node_kind, node_name) in self.names.items():
+            if node_kind == kind and node_name == name:
+                break
+        else:
+            raise ASTSearchException("Cannot find specified kind and identifier name")
+
+        end = i + self.weights[i]
+        return CompactAST(
+            self.weights[i:end],
+            self.fingerprints[i:end],
+            tuple(column[i:end] for column in self.positions),
+            {j - i: self.names[j] for j in self.names if i <= j < end},
+        )
@@ -1,42 +1,83 @@
-from language_parser.AST import AST
+from array import array
+
+from language_parser.AST import AST, CompactAST
 
 
 class FlattenedTree:
+    """
+    The nodes of a tree in the order Checker.check_v2() visits them.
+
+    It is never modified once built, so one FlattenedTree per file can be
+    shared by every pair the file is in. The nodes removed during a
+    comparison are kept by the caller, see removed().
+    """
     def __init__(self, ast):
-        self.flattened = ast.preorder()
-        self.flattened.sort(key=lambda node: node.weight, reverse=True)
-        self.removed = set()
+        """
+        Arguments:
+            ast: A hashed AST or its CompactAST
+        """
+        self.tree = ast if isinstance(ast, CompactAST) else CompactAST.from_ast(ast)
+        # Preorder positions sorted by weight
+        self.order = array("i", sorted(range(len(self.tree)), key=self.tree.weights.__getitem__, reverse=True))
 
-    def nodes(self):
-        self.removed = set()
+    def removed(self):
+        """
+        Returns:
+            The state of one comparison, a flag per node set by remove()
+        """
+        return bytearray(len(self.tree))
 
-        for node in self.flattened:
-            if node in self.removed:
+    def nodes(self, removed=None):
+        """
+        Yields:
+            The nodes by decreasing weight, skipping those flagged in removed
+        """
+        for node in self.order:
+            if removed is not None and removed[node]:
                 continue
             yield node
 
-    def remove(self, node):
-        self.removed.update(node.preorder())
+    def remove(self, removed, node):
+        # The subtree of a node is contiguous in preorder
+        end = node + self.tree.weights[node]
+        removed[node:end] = b"\x01" * (end - node)
 
     def __len__(self):
-        return len(self.flattened)
+        return len(self.order)
 
 
 class Checker:
     def __init__(self, path1, path2, ast1, ast2, threshold=5):
+        """
+        Arguments:
+            path1: The path of the first submission
+            path2: The path of the second submission
+            ast1: The hashed AST of the first submission, its CompactAST or
+                its FlattenedTree, which is shared rather than copied
+            ast2: The same for the second submission
+            threshold: The minimum weight of a subtree to be considered
+        """
         self.path1 = path1
         self.path2 = path2
-        self.flattened1 = FlattenedTree(ast1)
-        self.flattened2 = FlattenedTree(ast2)
+        self.flattened1 = ast1 if isinstance(ast1, FlattenedTree) else FlattenedTree(ast1)
+        self.flattened2 = ast2 if isinstance(ast2, FlattenedTree) else FlattenedTree(ast2)
 
         self.threshold = threshold
         self.similarity = 0
         self.overlapping_ranges = []
 
     def check_v2(self):
+        """
+        Compare the two submissions, setting similarity and
+        overlapping_ranges. The trees are released afterwards, so a Checker
+        is only checked once.
+        """
+        tree1 = self.flattened1.tree
+        tree2 = self.flattened2.tree
+
         flattened1_dict = {}
         for node in self.flattened1.nodes():
-            key = (node.weight, node.fingerprint)
+            key = (tree1.weights[node], tree1.fingerprints[node])
             if key in flattened1_dict:
                 flattened1_dict[key].append(node)
             else:
@@ -46,33 +87,39 @@ class Checker:
             flattened1_dict[key] = iter(flattened1_dict[key])
 
         overlaps = []
-        for node in self.flattened2.nodes():
-            if node.weight < self.threshold:
+        removed = self.flattened2.removed()
+        for node in self.flattened2.nodes(removed):
+            if tree2.weights[node] < self.threshold:
                 continue
 
-            key = (node.weight, node.fingerprint)
+            key = (tree2.weights[node], tree2.fingerprints[node])
             if key in flattened1_dict:
                 flattened1_node = next(flattened1_dict[key], None)
                 if flattened1_node is not None:
                     overlaps.append((flattened1_node, node))
 
-                    self.flattened2.remove(node)
-                    for sub_node in flattened1_node.preorder():
-                        sub_key = (sub_node.weight, sub_node.fingerprint)
+                    self.flattened2.remove(removed, node)
+                    for sub_node in range(flattened1_node, flattened1_node + tree1.weights[flattened1_node]):
+                        sub_key = (tree1.weights[sub_node], tree1.fingerprints[sub_node])
                         next(flattened1_dict[sub_key], None) # Purge the nodes in the sub tree
 
         num_of_same_nodes = 0
         for (node1, node2) in overlaps:
-            num_of_same_nodes += node1.weight
+            num_of_same_nodes += tree1.weights[node1]
             self.overlapping_ranges.append({
-                "A_start_pos":  node1.start_pos,
-                "A_end_pos":    node1.end_pos,
-                "B_start_pos":  node2.start_pos,
-                "B_end_pos":    node2.end_pos,
+                "A_start_pos":  tree1.start_pos(node1),
+                "A_end_pos":    tree1.end_pos(node1),
+                "B_start_pos":  tree2.start_pos(node2),
+                "B_end_pos":    tree2.end_pos(node2),
             })
 
         self.similarity = num_of_same_nodes / min(len(self.flattened1), len(self.flattened2))
 
+        # Only the score and the ranges are needed from here on, the trees
+        # may be the last references to a whole submission
+        self.flattened1 = None
+        self.flattened2 = None
+
     # The optimized version
     def check(self):
         """
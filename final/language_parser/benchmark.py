@@ -0,0 +1,525 @@
+"""
+Benchmark of the similarity pipeline on synthetic corpora.
+
+Generates Python and C submissions of a configurable count and length, a
+share of which are plagiarised from others (identifiers renamed, functions
+reordered, comments added and a few statements rewritten), then times each
+stage separately and writes the timings, throughput and memory to JSON:
+
+    python -m language_parser.benchmark --files 200 --output bench.json
+
+Run from the directory holding language_parser, like the app.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+from language_parser.AST import CompactAST, ASTSearchException
+from language_parser.AST import SHA256_FINGERPRINTS, HASH64_FINGERPRINTS, InternedFingerprints
+from language_parser.Checker import Checker, FlattenedTree
+from language_parser.index import FingerprintIndex
+from language_parser.minhash import MinHashLSH
+from language_parser.parsers import get_parser
+from language_parser.pythonast import PYTHON_LANGUAGE, PYTHON_FUNCTION_KIND, PYTHON_IGNORE_KINDS, PYTHON_NAME_GETTERS
+from language_parser.c_ast import C_LANGUAGE, C_FUNCTION_KIND, C_IGNORE_KINDS, C_NAME_GETTERS
+
+# The function every generated submission defines, used by the filter stage
+TARGET_FUNCTION = "solve"
+
+ARITHMETIC_OPERATORS = ["+", "-", "*", "%"]
+COMPARISON_OPERATORS = ["<", ">", "<=", ">=", "==", "!="]
+WORDS = ["count", "total", "value", "index", "result", "temp", "acc", "step", "best", "cur", "left", "right"]
+
+
+class ProgramGenerator:
+    """
+    Random programs as language independent statement trees, rendered to
+    Python or C afterwards. Statements are tuples:
+
+        ("assign", variable, expression)
+        ("if", condition, then statements, else statements)
+        ("for", loop variable, bound expression, statements)
+        ("return", expression)
+
+    and expressions ("var", name), ("num", value), ("bin", operator, left,
+    right), ("call", function, arguments) or ("cmp", operator, left, right).
+    """
+    def __init__(self, rng, functions, statements):
+        """
+        Arguments:
+            rng: A random.Random
+            functions: The number of helper functions per program
+            statements: The number of statements per function
+        """
+        self.rng = rng
+        self.functions = functions
+        self.statements = statements
+
+    def expression(self, variables, callables, depth=0):
+        roll = self.rng.random()
+        if depth >= 2 or roll < 0.3:
+            if self.rng.random() < 0.6:
+                return ("var", self.rng.choice(variables))
+            return ("num", self.rng.randint(0, 100))
+        if roll < 0.4 and len(callables) > 0:
+            return ("call", self.rng.choice(callables), [self.expression(variables, callables, depth + 1) for _ in range(2)])
+        return (
+            "bin",
+            self.rng.choice(ARITHMETIC_OPERATORS),
+            self.expression(variables, callables, depth + 1),
+            self.expression(variables, callables, depth + 1),
+        )
+
+    def condition(self, variables, callables):
+        return (
+            "cmp",
+            self.rng.choice(COMPARISON_OPERATORS),
+            self.expression(variables, callables, 1),
+            self.expression(variables, callables, 1),
+        )
+
+    def block(self, variables, callables, count, depth):
+        body = []
+        for _ in range(count):
+            roll = self.rng.random()
+            if depth < 2 and roll < 0.15:
+                loop_variable = f"i{depth}"
+                inner = self.block(variables + [loop_variable], callables, max(1, count // 3), depth + 1)
+                body.append(("for", loop_variable, self.expression(variables, callables, 1), inner))
+            elif depth < 2 and roll < 0.3:
+                then_body = self.block(variables, callables, max(1, count // 3), depth + 1)
+                else_body = self.block(variables, callables, max(1, count // 4), depth + 1) if self.rng.random() < 0.5 else []
+                body.append(("if", self.condition(variables, callables), then_body, else_body))
+            else:
+                body.append(("assign", self.rng.choice(variables[2:]), self.expression(variables, callables)))
+        return body
+
+    def function(self, name, callables):
+        variables = ["a", "b"] + [f"v{k}" for k in range(4)]
+        body = self.block(variables, callables, self.statements, 0)
+        body.append(("return", self.expression(variables, callables)))
+        return (name, variables, body)
+
+    def program(self):
+        functions = []
+        for k in range(self.functions):
+            functions.append(self.function(f"f{k}", [f"f{m}" for m in range(k)]))
+        functions.append(self.function(TARGET_FUNCTION, [f"f{k}" for k in range(self.functions)]))
+        return functions
+
+    def plagiarise(self, program, rewrite_rate=0.1):
+        """
+        Returns:
+            A copy of a program with its helper functions shuffled and some
+            of its assignments rewritten
+        """
+        def rewrite(body, variables, callables):
+            copied = []
+            for statement in body:
+                if statement[0] == "assign" and self.rng.random() < rewrite_rate:
+                    copied.append(("assign", statement[1], self.expression(variables, callables)))
+                elif statement[0] == "if":
+                    copied.append(("if", statement[1], rewrite(statement[2], variables, callables), rewrite(statement[3], variables, callables)))
+                elif statement[0] == "for":
+                    copied.append(("for", statement[1], statement[2], rewrite(statement[3], variables + [statement[1]], callables)))
+                else:
+                    copied.append(statement)
+            return copied
+
+        helpers = [
+            (name, variables, rewrite(body, variables, [f"f{m}" for m in range(k)]))
+            for k, (name, variables, body) in enumerate(program[:-1])
+        ]
+        # Only parsed, never compiled, so the order needn't declare before use
+        self.rng.shuffle(helpers)
+        name, variables, body = program[-1]
+        return helpers + [(name, variables, rewrite(body, variables, [f"f{k}" for k in range(self.functions)]))]
+
+    def names(self):
+        """
+        Returns:
+            A random renaming of the generated identifiers, the target
+            function keeps its name
+        """
+        names = {TARGET_FUNCTION: TARGET_FUNCTION}
+        used = {TARGET_FUNCTION}
+        for identifier in ["a", "b"] + [f"v{k}" for k in range(4)] + [f"i{k}" for k in range(2)] + [f"f{k}" for k in range(self.functions)]:
+            while True:
+                candidate = f"{self.rng.choice(WORDS)}_{self.rng.randint(0, 99)}"
+                if candidate not in used:
+                    break
+            used.add(candidate)
+            names[identifier] = candidate
+        return names
+
+
+def render_expression(expression, names):
+    kind = expression[0]
+    if kind == "var":
+        return names[expression[1]]
+    if kind == "num":
+        return str(expression[1])
+    if kind == "call":
+        arguments = ", ".join(render_expression(argument, names) for argument in expression[2])
+        return f"{names[expression[1]]}({arguments})"
+    return f"({render_expression(expression[2], names)} {expression[1]} {render_expression(expression[3], names)})"
+
+
+def render_python(program, names, comment_rng=None):
+    lines = []
+    def block(body, indent):
+        pad = "    " * indent
+        for statement in body:
+            if comment_rng is not None and comment_rng.random() < 0.1:
+                lines.append(f"{pad}# {comment_rng.choice(WORDS)}")
+            kind = statement[0]
+            if kind == "assign":
+                lines.append(f"{pad}{names[statement[1]]} = {render_expression(statement[2], names)}")
+            elif kind == "return":
+                lines.append(f"{pad}return {render_expression(statement[1], names)}")
+            elif kind == "for":
+                lines.append(f"{pad}for {names[statement[1]]} in range({render_expression(statement[2], names)} % 10):")
+                block(statement[3], indent + 1)
+            elif kind == "if":
+                lines.append(f"{pad}if {render_expression(statement[1], names)}:")
+                block(statement[2], indent + 1)
+                if len(statement[3]) > 0:
+                    lines.append(f"{pad}else:")
+                    block(statement[3], indent + 1)
+
+    for (name, variables, body) in program:
+        lines.append(f"def {names[name]}({names['a']}, {names['b']}):")
+        for variable in variables[2:]:
+            lines.append(f"    {names[variable]} = 0")
+        block(body, 1)
+        lines.append("")
+    lines.append("if __name__ == \"__main__\":")
+    lines.append(f"    print({TARGET_FUNCTION}(int(input()), int(input())))")
+    return "\n".join(lines) + "\n"
+
+
+def render_c(program, names, comment_rng=None):
+    lines = ["#include <stdio.h>", ""]
+    def block(body, indent):
+        pad = "    " * indent
+        for statement in body:
+            if comment_rng is not None and comment_rng.random() < 0.1:
+                lines.append(f"{pad}// {comment_rng.choice(WORDS)}")
+            kind = statement[0]
+            if kind == "assign":
+                lines.append(f"{pad}{names[statement[1]]} = {render_expression(statement[2], names)};")
+            elif kind == "return":
+                lines.append(f"{pad}return {render_expression(statement[1], names)};")
+            elif kind == "for":
+                loop_variable = names[statement[1]]
+                bound = render_expression(statement[2], names)
+                lines.append(f"{pad}for (int {loop_variable} = 0; {loop_variable} < {bound} % 10; {loop_variable}++) {{")
+                block(statement[3], indent + 1)
+                lines.append(f"{pad}}}")
+            elif kind == "if":
+                lines.append(f"{pad}if {render_expression(statement[1], names)} {{")
+                block(statement[2], indent + 1)
+                if len(statement[3]) > 0:
+                    lines.append(f"{pad}}} else {{")
+                    block(statement[3], indent + 1)
+                lines.append(f"{pad}}}")
+
+    for (name, variables, body) in program:
+        lines.append(f"int {names[name]}(int {names['a']}, int {names['b']}) {{")
+        for variable in variables[2:]:
+            lines.append(f"    int {names[variable]} = 0;")
+        block(body, 1)
+        lines.append("}")
+        lines.append("")
+    lines.append("int main() {")
+    lines.append(f"    int {names['a']}, {names['b']};")
+    lines.append(f"    scanf(\"%d %d\", &{names['a']}, &{names['b']});")
+    lines.append(f"    printf(\"%d\\n\", {TARGET_FUNCTION}({names['a']}, {names['b']}));")
+    lines.append("    return 0;")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+# Language -> (extension, renderer, tree-sitter language, ignored kinds,
+# name getters, function kind)
+LANGUAGES = {
+    "python": (".py", render_python, PYTHON_LANGUAGE, PYTHON_IGNORE_KINDS, PYTHON_NAME_GETTERS, PYTHON_FUNCTION_KIND),
+    "c": (".c", render_c, C_LANGUAGE, C_IGNORE_KINDS, C_NAME_GETTERS, C_FUNCTION_KIND),
+}
+
+FINGERPRINTS = {
+    "sha256": lambda: SHA256_FINGERPRINTS,
+    "hash64": lambda: HASH64_FINGERPRINTS,
+    "interned": InternedFingerprints,
+}
+
+
+def generate_corpus(language, files, functions, statements, plagiarism_rate, seed=0):
+    """
+    Generate synthetic submissions
+
+    Arguments:
+        language: A key of LANGUAGES
+        files: The number of submissions
+        functions: The number of helper functions per submission
+        statements: The number of statements per function
+        plagiarism_rate: The share of submissions copied from an earlier one
+        seed: The random seed, the same arguments give the same corpus
+
+    Returns:
+        A list of (file name, source bytes, file name of the original or None)
+    """
+    extension, render = LANGUAGES[language][:2]
+    rng = random.Random(seed)
+    generator = ProgramGenerator(rng, functions, statements)
+
+    corpus = []
+    programs = []
+    for k in range(files):
+        filename = f"submission{k}{extension}"
+        if len(programs) > 0 and rng.random() < plagiarism_rate:
+            original_id = rng.randrange(len(programs))
+            program = generator.plagiarise(programs[original_id])
+            source = render(program, generator.names(), comment_rng=rng)
+            corpus.append((filename, source.encode(), corpus[original_id][0]))
+        else:
+            program = generator.program()
+            source = render(program, generator.names())
+            corpus.append((filename, source.encode(), None))
+        programs.append(program)
+    return corpus
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Stage:
+    """
+    Times a stage and records the memory high-water marks. The process peak
+    RSS only ever grows, so it is the peak up to the end of the stage. With
+    trace_memory the peak of the Python allocations made during the stage is
+    recorded too, at the cost of slower timings.
+    """
+    def __init__(self, stats, name, trace_memory=False):
+        self.stats = stats
+        self.name = name
+        self.trace_memory = trace_memory
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start_time
+        self.stats[self.name] = {"seconds": seconds, "peak_rss_kb": peak_rss_kb()}
+        if self.trace_memory:
+            self.stats[self.name]["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def throughput(self, unit, count):
+        seconds = self.stats[self.name]["seconds"]
+        self.stats[self.name][unit] = count
+        self.stats[self.name][f"{unit}_per_second"] = count / seconds if seconds > 0 else None
+
+
+def benchmark_language(language, corpus, threshold=5, fingerprints="interned", max_pairs=2000, trace_memory=False, seed=0, lsh=None):
+    """
+    Time the pipeline stages on a corpus
+
+    Arguments:
+        language: A key of LANGUAGES
+        corpus: The result of generate_corpus()
+        threshold: The minimum weight of a subtree to be considered
+        fingerprints: A key of FINGERPRINTS
+        max_pairs: The number of pairs timed with check_v2(), sampled when
+            the corpus has more
+        trace_memory: Also record the peak Python allocations per stage
+        seed: The seed of the pair sampling
+        lsh: A MinHashLSH to time as a prefilter of the index, None to skip
+            it. Its recall is the share of plagiarised submissions it pairs
+            with their original.
+
+    Returns:
+        A dict of corpus statistics and per stage measurements
+    """
+    _, _, tree_sitter_language, ignore_kinds, name_getters, function_kind = LANGUAGES[language]
+    parser = get_parser(tree_sitter_language)
+    stats = {}
+
+    with Stage(stats, "parse", trace_memory) as stage:
+        trees = [parser.parse(source) for (_, source, _) in corpus]
+    stage.throughput("files", len(corpus))
+    stage.throughput("bytes", sum(len(source) for (_, source, _) in corpus))
+
+    mode = FINGERPRINTS[fingerprints]()
+    with Stage(stats, "hash", trace_memory) as stage:
+        compacts = [
+            CompactAST.from_cursor(tree.walk(), mode, ignore_kinds=ignore_kinds, name_getters=name_getters)
+            for tree in trees
+        ]
+    nodes = sum(len(compact) for compact in compacts)
+    stage.throughput("nodes", nodes)
+    del trees
+
+    with Stage(stats, "filter", trace_memory) as stage:
+        functions = {}
+        for (filename, _, _), compact in zip(corpus, compacts):
+            try:
+                functions[filename] = compact.subtree(function_kind, TARGET_FUNCTION.encode())
+            except ASTSearchException:
+                pass
+    stage.throughput("files", len(compacts))
+
+    filenames = list(functions.keys())
+    pairs = [(i, j) for i in range(len(filenames)) for j in range(i + 1, len(filenames))]
+    if len(pairs) > max_pairs:
+        pairs = sorted(random.Random(seed).sample(pairs, max_pairs))
+
+    with Stage(stats, "check", trace_memory) as stage:
+        # Flattened once per file and shared by all its pairs
+        flattened = [FlattenedTree(functions[filename]) for filename in filenames]
+        for (i, j) in pairs:
+            checker = Checker(filenames[i], filenames[j], flattened[i], flattened[j], threshold)
+            checker.check_v2()
+    stage.throughput("pairs", len(pairs))
+
+    # The path driver() takes: only pairs sharing a subtree are checked
+    matches = 0
+    with Stage(stats, "index", trace_memory) as stage:
+        index = FingerprintIndex(functions, threshold=threshold)
+        candidate_pairs = 0
+        for i in range(len(index)):
+            for (j, shared_ranks) in index.candidates(i):
+                candidate_pairs += 1
+                similarity, _ = index.compare(i, j, shared_ranks)
+                if similarity > 0:
+                    matches += 1
+    stage.throughput("pairs", len(filenames) * (len(filenames) - 1) // 2)
+    stats["index"]["candidate_pairs"] = candidate_pairs
+    stats["index"]["matched_pairs"] = matches
+
+    if lsh is not None:
+        # Sketches need the fingerprints that don't depend on the process or
+        # the file order, the functions are rehashed outside the stage if the
+        # run uses others
+        if mode is HASH64_FINGERPRINTS:
+            sketched = functions
+        else:
+            sketched = {}
+            for (filename, source, _) in corpus:
+                if filename in functions:
+                    compact = CompactAST.from_cursor(
+                        parser.parse(source).walk(), HASH64_FINGERPRINTS,
+                        ignore_kinds=ignore_kinds, name_getters=name_getters,
+                    )
+                    sketched[filename] = compact.subtree(function_kind, TARGET_FUNCTION.encode())
+
+        lsh_matches = 0
+        with Stage(stats, "lsh", trace_memory) as stage:
+            sketches = [lsh.sketch(sketched[filename], threshold) for filename in filenames]
+            lsh_pairs = lsh.candidate_pairs(sketches)
+            for (i, j) in sorted(lsh_pairs):
+                shared_ranks = index.shared_ranks(i, j)
+                if len(shared_ranks) == 0:
+                    continue
+                similarity, _ = index.compare(i, j, shared_ranks)
+                if similarity > 0:
+                    lsh_matches += 1
+        stage.throughput("pairs", len(filenames) * (len(filenames) - 1) // 2)
+
+        # The share of the plagiarised submissions paired with their original
+        positions = {filename: i for i, filename in enumerate(filenames)}
+        plagiarised = set()
+        for (filename, _, original) in corpus:
+            if original is not None and filename in positions and original in positions:
+                i, j = positions[original], positions[filename]
+                plagiarised.add((min(i, j), max(i, j)))
+
+        stats["lsh"]["settings"] = lsh.settings()
+        stats["lsh"]["candidate_pairs"] = len(lsh_pairs)
+        stats["lsh"]["matched_pairs"] = lsh_matches
+        stats["lsh"]["recall"] = len(plagiarised & lsh_pairs) / len(plagiarised) if len(plagiarised) > 0 else None
+
+    return {
+        "files": len(corpus),
+        "plagiarised_files": sum(1 for (_, _, original) in corpus if original is not None),
+        "bytes": sum(len(source) for (_, source, _) in corpus),
+        "nodes": nodes,
+        "function_nodes": sum(len(compact) for compact in functions.values()),
+        "stages": stats,
+    }
+
+
+def git_commit():
+    try:
+        process = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+    return process.stdout.strip() if process.returncode == 0 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the similarity pipeline on synthetic corpora")
+    parser.add_argument("--languages", nargs="+", default=list(LANGUAGES), choices=list(LANGUAGES))
+    parser.add_argument("--files", type=int, default=100, help="submissions per language")
+    parser.add_argument("--functions", type=int, default=4, help="helper functions per submission")
+    parser.add_argument("--statements", type=int, default=10, help="statements per function")
+    parser.add_argument("--plagiarism", type=float, default=0.3, help="share of plagiarised submissions")
+    parser.add_argument("--threshold", type=int, default=5)
+    parser.add_argument("--fingerprints", default="interned", choices=list(FINGERPRINTS))
+    parser.add_argument("--max-pairs", type=int, default=2000, help="pairs timed with check_v2()")
+    parser.add_argument("--trace-memory", action="store_true", help="record the peak Python allocations per stage")
+    parser.add_argument("--lsh-bands", type=int, default=None, help="also time a MinHash LSH prefilter with this many bands")
+    parser.add_argument("--lsh-rows", type=int, default=3, help="permutations per LSH band")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus-dir", help="also write the generated submissions here")
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    report = {
+        "current_datetime": str(datetime.now()),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "languages": {},
+    }
+    for language in args.languages:
+        corpus = generate_corpus(language, args.files, args.functions, args.statements, args.plagiarism, args.seed)
+        if args.corpus_dir is not None:
+            directory = os.path.join(args.corpus_dir, language)
+            os.makedirs(directory, exist_ok=True)
+            for (filename, source, _) in corpus:
+                with open(os.path.join(directory, filename), "wb") as f:
+                    f.write(source)
+
+        report["languages"][language] = benchmark_language(
+            language,
+            corpus,
+            threshold=args.threshold,
+            fingerprints=args.fingerprints,
+            max_pairs=args.max_pairs,
+            trace_memory=args.trace_memory,
+            seed=args.seed,
+            lsh=MinHashLSH(args.lsh_bands, args.lsh_rows) if args.lsh_bands is not None else None,
+        )
+
+        for name, stage in report["languages"][language]["stages"].items():
+            print(f"{language:>6} {name:>6}: {stage['seconds']:.3f}s")
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,10 @@
 import os
-from tree_sitter import Language, Parser
-import tree_sitter_c as tsc
 from typing import List
 
-from language_parser.AST import AST, ASTGenerationException
+from language_parser.AST import AST, CompactAST, ASTGenerationException, SHA256_FINGERPRINTS
+from language_parser.parsers import get_parser
 
-C_LANG = Language(tsc.language(), "c")
+C_LANGUAGE = "c"
 C_FUNCTION_KIND = "function_definition"
 C_FUNCTION_DECLARATION_KIND = "function_declarator"
 C_IDENTIFIER_KIND = "identifier"
@@ -14,7 +13,23 @@ C_IGNORE_KINDS = {
     C_INLINE_COMMENT
 }
 
+
+def c_function_name(node):
+    name = ""
+    for child in node.children:
+        if child.type == C_FUNCTION_DECLARATION_KIND:
+            for sub_node in child.children:
+                if sub_node.type == C_IDENTIFIER_KIND:
+                    name = sub_node.text
+    return name
+
+C_NAME_GETTERS = {
+    C_FUNCTION_KIND: c_function_name
+}
+
 class C_AST(AST):
+    LANGUAGE = C_LANGUAGE
+
     def __init__(self, parent=None, name=None, text=None, start_pos=None, end_pos=None, kind=None):
         AST.__init__(self, parent, name, text, start_pos, end_pos, kind)
 
@@ -58,9 +73,21 @@ class C_AST(AST):
             return c_ast_node
 
         with open(path, "rb") as f:
-            parser = Parser()
-            parser.set_language(C_LANG)
+            parser = get_parser(C_LANGUAGE)
 
             tree = parser.parse(f.read())
             cursor = tree.walk()
-            return helper(cursor)
\ No newline at end of file
+            return helper(cursor)
+
+    @classmethod
+    def create_compact(cls, path, fingerprints=SHA256_FINGERPRINTS):
+        with open(path, "rb") as f:
+            parser = get_parser(C_LANGUAGE)
+
+            tree = parser.parse(f.read())
+            return CompactAST.from_cursor(
+                tree.walk(),
+                fingerprints,
+                ignore_kinds=C_IGNORE_KINDS,
+                name_getters=C_NAME_GETTERS,
+            )
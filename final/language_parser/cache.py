@@ -0,0 +1,127 @@
+import os
+import pickle
+import tempfile
+from hashlib import sha256
+
+from language_parser.AST import CompactAST
+from language_parser.parsers import LANGUAGE_PACKAGES
+
+# Bump whenever the fingerprints or the CompactAST layout change
+CACHE_VERSION = 3
+
+
+def _package_version(package):
+    from importlib import metadata
+
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+class FingerprintCache:
+    """
+    Content-addressed on-disk cache of CompactASTs.
+
+    Entries are keyed by the file bytes, the AST class (language), the
+    fingerprinting mode, the cache version and the versions of tree-sitter
+    and of the language's grammar, so a changed file, parser or grammar
+    never hits a stale entry. Hits refresh the entry's mtime and evict()
+    removes the least recently used entries once the cache grows past
+    max_bytes.
+    """
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # AST class -> the versions of tree-sitter and its grammar
+        self.parser_versions = {}
+
+    def key(self, AST_class, source, fingerprints):
+        """
+        Arguments:
+            AST_class: The AST class used to parse the source
+            source: The bytes of the source file
+            fingerprints: The fingerprinting mode of the CompactAST
+
+        Returns:
+            The cache key of the source
+        """
+        parser_version = self.parser_versions.get(AST_class)
+        if parser_version is None:
+            grammar = LANGUAGE_PACKAGES.get(getattr(AST_class, "LANGUAGE", None))
+            grammar_version = _package_version(grammar) if grammar is not None else "unknown"
+            parser_version = f"{_package_version('tree_sitter')}\0{grammar_version}"
+            self.parser_versions[AST_class] = parser_version
+        header = f"{AST_class.__name__}\0{type(fingerprints).__name__}\0{CACHE_VERSION}\0{parser_version}\0".encode()
+        return sha256(header + source).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".pkl")
+
+    def get(self, key):
+        """
+        Returns:
+            The cached CompactAST, or None on a miss. An entry that can't be
+            read or unpickled, e.g. a corrupt one, is a miss too.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                compact_ast = pickle.load(f)
+        except Exception:
+            return None
+
+        if not isinstance(compact_ast, CompactAST):
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return compact_ast
+
+    def put(self, key, compact_ast):
+        """
+        Store a CompactAST. The entry is written to a temporary file first and
+        renamed into place so concurrent readers never see a partial entry.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(compact_ast, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in
+        max_bytes
+        """
+        entries = []
+        total_size = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".pkl"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+        entries.sort()
+        for (_, size, path) in entries:
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
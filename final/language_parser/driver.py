@@ -1,133 +1,453 @@
 import os
 import sys
+import time
 from typing import List
 from datetime import datetime
-from tqdm import tqdm
-import tree_sitter_python as tspython
-import tree_sitter_c as tsc
-import ast
-from icecream import ic
+from hashlib import sha256
+from concurrent.futures import ProcessPoolExecutor
 from language_parser.pythonast import *
 from language_parser.c_ast import *
 
-from language_parser.Checker import Checker
+from language_parser.index import FingerprintIndex, compare_parallel, select_pairs
+from language_parser.minhash import MinHashLSH
+from language_parser.instrument import Instrumentation
+from language_parser.cache import FingerprintCache
 from language_parser.AST import AST, ASTGenerationException, ASTSearchException
+from language_parser.AST import HASH64_FINGERPRINTS, InternedFingerprints
 
-def driver(
+def parse_file(job):
+    """
+    Parse and hash a single file, going through the cache if one is given.
+    Runs in a worker process when driver() is given workers, so only
+    picklable values go in and out.
+
+    Arguments:
+        job: A tuple of (AST class, filename, FingerprintCache or None,
+            fingerprinting mode, kwargs for AST_class.create())
+
+    Returns:
+        A tuple of (CompactAST or None, digest of the file bytes or None,
+        warning or None, seconds spent, whether it came from the cache)
+    """
+    AST_class, filename, cache, fingerprints, kwargs = job
+    start_time = time.perf_counter()
+    try:
+        with open(filename, "rb") as f:
+            source = f.read()
+    except FileNotFoundError:
+        return None, None, f"{filename} not found", time.perf_counter() - start_time, False
+
+    digest = sha256(source).hexdigest()
+    if cache is not None:
+        key = cache.key(AST_class, source, fingerprints)
+        compact_ast = cache.get(key)
+        if compact_ast is not None:
+            return compact_ast, digest, None, time.perf_counter() - start_time, True
+
+    try:
+        compact_ast = AST_class.create_compact(filename, fingerprints, **kwargs)
+    except ASTGenerationException:
+        return None, None, f"{filename} cannot be properly parsed", time.perf_counter() - start_time, False
+    except FileNotFoundError:
+        return None, None, f"{filename} not found", time.perf_counter() - start_time, False
+
+    if cache is not None:
+        cache.put(key, compact_ast)
+    return compact_ast, digest, None, time.perf_counter() - start_time, False
+
+def compare_incremental(trees, digests, previous, threshold):
+    """
+    Compare only the pairs involving a new or changed submission and reuse
+    the previous result for the others
+
+    Arguments:
+        trees: A dict mapping the path of each submission to its CompactAST
+        digests: A dict mapping the path of each submission to its digest
+        previous: A result of driver() on an earlier version of the same
+            submissions, with the same function and threshold
+        threshold: The minimum weight of a subtree to be considered
+
+    Returns:
+        A list of (file id 1, file id 2, similarity, overlapping ranges) in
+        the same order as a full run
+    """
+    keys = list(trees.keys())
+    positions = {path: i for i, path in enumerate(keys)}
+    previous_digests = previous["digests"]
+    changed = {i for i, path in enumerate(keys) if previous_digests.get(path) != digests[path]}
+
+    index = FingerprintIndex(trees, threshold=threshold)
+    pairs = []
+    for row in previous["result"]:
+        i = positions.get(row["submission_A"])
+        j = positions.get(row["submission_B"])
+        if i is None or j is None or i in changed or j in changed:
+            continue
+
+        if i < j:
+            pairs.append((i, j, row["similarity"], row["overlapping_ranges"]))
+        else:
+            # The listing order changed, the comparison is not symmetric
+            shared_ranks = index.shared_ranks(j, i)
+            if len(shared_ranks) > 0:
+                pairs.append((j, i) + index.compare(j, i, shared_ranks))
+
+    for i in sorted(changed):
+        for (j, shared_ranks) in index.candidates(i):
+            pairs.append((i, j) + index.compare(i, j, shared_ranks))
+        for (j, shared_ranks) in index.candidates_before(i):
+            if j not in changed:
+                pairs.append((j, i) + index.compare(j, i, shared_ranks))
+
+    pairs.sort(key=lambda pair: (pair[0], pair[1]))
+    return pairs
+
+def iter_driver(
     AST_class: AST,
     source_filenames: List[str],
     function_name: str,
     function_kind: str,
     threshold: int,
+    workers: int = None,
+    tile_size: int = 32,
+    cache: FingerprintCache = None,
+    previous: dict = None,
+    min_similarity: float = 0,
+    top_k: int = None,
+    lsh: MinHashLSH = None,
+    progress: bool = True,
+    stats: bool = False,
+    profile: bool = False,
+    trace_memory: bool = False,
+    on_stage=None,
+    result: dict = None,
     **kwargs
 ):
+    """
+    Run the similarity check on a set of submissions, yielding each listed
+    pair as soon as it is known instead of collecting them. Without top_k the
+    serial path yields a pair right after comparing it, the parallel path
+    one row block of tiles at a time.
 
-    result = {}
+    Only pairs with a similarity of at least min_similarity are listed. With
+    top_k, only the top_k most similar of them are, by decreasing
+    similarity, and the overlapping ranges are only built for those.
 
-    result["current_datetime"] = str(datetime.now())
+    With lsh, a MinHashLSH, only the pairs it selects are compared, which
+    is much faster on large corpora but may miss some similar pairs, see
+    MinHashLSH for the trade-off. The pairs compared still get their exact
+    similarity. It runs as its own stage, disables incremental runs and
+    hashes with HASH64_FINGERPRINTS even in serial runs without a cache.
 
-    start_time = datetime.now()
+    Besides the arguments documented elsewhere, progress writes progress bars
+    to stderr. stats adds result["stats"] with the duration of each stage
+    (parse, which includes the hashing, filter, lsh and compare), the parse time,
+    node count and cache use of each file and the pair and match counts.
+    profile adds a cProfile report as result["profile"], trace_memory the
+    peak Python allocations of each stage, and on_stage is called with the
+    name and measurements of each stage as soon as it ends.
 
-    warnings = []
-    result["function"] = function_name
-    result["warnings"] = warnings
+    Everything driver() returns but the pairs, like the warnings and the
+    digests, is filled into result if given. The timings and statistics are
+    added once the pairs are exhausted.
 
-    # Translate all code to ASTs
-    print("Parsing files...", file=sys.stderr)
-    asts = {}
-    for filename in tqdm(source_filenames):
-        try:
-            ast = AST_class.create(filename, **kwargs)
-            ast.display()
-        except ASTGenerationException:
-            warnings.append(f"{filename} cannot be properly parsed")
-            continue
-        except FileNotFoundError:
-            warnings.append(f"{filename} not found")
-            continue
+    Yields:
+        Dicts with submission_A, submission_B, similarity and
+        overlapping_ranges, like the rows of driver()'s result
+    """
+    from tqdm import tqdm
+
+    def track(iterable, total=None):
+        return tqdm(iterable, total=total) if progress else iterable
+
+    def log(message):
+        if progress:
+            print(message, file=sys.stderr)
+
+    instrumentation = Instrumentation(on_stage=on_stage, profile=profile, trace_memory=trace_memory)
+    instrumentation.start()
+
+    # Stopped however the run ends: normally, by the caller dropping the
+    # generator or by an exception, the profilers mustn't outlive it
+    try:
+        if result is None:
+            result = {}
+
+        result["current_datetime"] = str(datetime.now())
+
+        start_time = datetime.now()
+
+        warnings = []
+        result["function"] = function_name
+        result["warnings"] = warnings
+
+        # Translate all code to compact hashed ASTs
+        log("Parsing files...")
+        asts = {}
+        parallel = workers is not None and workers > 1 and len(source_filenames) > 1
+        # Interned ids are only meaningful within this process, worker processes
+        # and the cache need fingerprints that are stable across processes. So
+        # do the LSH sketches, for the same pairs to be selected however the
+        # files were parsed.
+        if parallel or cache is not None or lsh is not None:
+            fingerprints = HASH64_FINGERPRINTS
+        else:
+            fingerprints = InternedFingerprints()
+
+        with instrumentation.stage("parse") as measurements:
+            jobs = [(AST_class, filename, cache, fingerprints, kwargs) for filename in source_filenames]
+            if parallel:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    chunksize = max(1, len(jobs) // (workers * 4))
+                    parsed = list(track(executor.map(parse_file, jobs, chunksize=chunksize), total=len(jobs)))
+            else:
+                parsed = [parse_file(job) for job in track(jobs)]
+
+            if cache is not None:
+                cache.evict()
 
-        ast.hash_non_recursive()
-        asts[os.path.abspath(filename)] = ast
-
-    # Find Sub ASTs based on function name and kind
-    function_name = function_name.encode()
-    if function_name != b'*':
-        print("Filtering partial code...", file=sys.stderr)
-        new_asts = {}
-        for path in tqdm(asts):
-            try:
-                sub_ast = asts[path].subtree(function_kind, function_name)
-                new_asts[path] = sub_ast
-            except ASTSearchException:
-                warnings.append(f"{path} doesn't have {function_name}")
-
-        asts = new_asts
-
-    # Run similarity checking algorithm
-    checkers = []
-    keys = list(asts.keys())
-
-    print("Running plagiarism detection algorithm...", file=sys.stderr)
-    with tqdm(total=(1 + len(keys) - 1)*(len(keys)-1)//2) as pbar:
-        for i in range(len(keys)):
-            for j in range(i + 1, len(keys)):
-                path1 = keys[i]
-                path2 = keys[j]
-                checker = Checker(
-                    path1,
-                    path2,
-                    asts[path1],
-                    asts[path2],
-                    threshold=threshold,
+            # Results come back in input order, so are the warnings
+            digests = {}
+            file_stats = []
+            for filename, (compact_ast, digest, warning, seconds, cached) in zip(source_filenames, parsed):
+                if stats:
+                    file_stats.append({
+                        "path": os.path.abspath(filename),
+                        "parse_time": seconds,
+                        "nodes": len(compact_ast) if compact_ast is not None else 0,
+                        "cached": cached,
+                    })
+                if warning is not None:
+                    warnings.append(warning)
+                    continue
+
+                asts[os.path.abspath(filename)] = compact_ast
+                digests[os.path.abspath(filename)] = digest
+            # asts holds the only references left, so the whole-file trees are
+            # freed as soon as the filter below replaces them by their subtrees
+            del parsed
+            measurements["files"] = len(asts)
+
+        # Find Sub ASTs based on function name and kind
+        function_name = function_name.encode()
+        with instrumentation.stage("filter") as measurements:
+            if function_name != b'*':
+                log("Filtering partial code...")
+                new_asts = {}
+                for path in track(asts):
+                    try:
+                        sub_ast = asts[path].subtree(function_kind, function_name)
+                        new_asts[path] = sub_ast
+                    except ASTSearchException:
+                        warnings.append(f"{path} doesn't have {function_name}")
+
+                asts = new_asts
+            measurements["files"] = len(asts)
+
+        # Run similarity checking algorithm on the pairs sharing a subtree
+        keys = list(asts.keys())
+        # Kept so that a later run can be given this result as previous
+        result["threshold"] = threshold
+        result["min_similarity"] = min_similarity
+        result["top_k"] = top_k
+        result["lsh"] = lsh.settings() if lsh is not None else None
+        result["digests"] = {path: digests[path] for path in keys}
+
+        lsh_pairs = None
+        if lsh is not None:
+            log("Selecting candidate pairs...")
+            with instrumentation.stage("lsh") as measurements:
+                sketches = [lsh.sketch(asts[path], threshold) for path in track(keys)]
+                lsh_pairs = lsh.candidate_pairs(sketches)
+                del sketches
+                measurements["candidates"] = len(lsh_pairs)
+
+        log("Running plagiarism detection algorithm...")
+        with instrumentation.stage("compare") as measurements:
+            # Unchanged pairs missing from a filtered previous result are below
+            # min_similarity, but may have been cut by its top_k
+            incremental = (
+                previous is not None
+                and previous.get("function") == result["function"]
+                and previous.get("threshold") == threshold
+                and previous.get("min_similarity", 0) == min_similarity
+                and previous.get("top_k") is None
+                and lsh is None
+                and previous.get("lsh") is None
+                and "digests" in previous
+            )
+            if incremental:
+                pairs = select_pairs(compare_incremental(asts, digests, previous, threshold), min_similarity, top_k)
+            elif workers is not None and workers > 1 and len(keys) > 1:
+                pairs = select_pairs(
+                    compare_parallel(
+                        asts,
+                        threshold=threshold,
+                        workers=workers,
+                        tile_size=tile_size,
+                        min_similarity=min_similarity,
+                        top_k=top_k,
+                        pairs=lsh_pairs,
+                    ),
+                    min_similarity,
+                    top_k,
                 )
+            else:
+                index = FingerprintIndex(asts, threshold=threshold)
+                if lsh_pairs is None:
+                    candidates = (
+                        (i, j, shared_ranks)
+                        for i in range(len(keys))
+                        for (j, shared_ranks) in index.candidates(i)
+                    )
+                else:
+                    candidates = (
+                        (i, j, shared_ranks)
+                        for (i, j) in sorted(lsh_pairs)
+                        for shared_ranks in [index.shared_ranks(i, j)]
+                        if len(shared_ranks) > 0
+                    )
+                matches = ((i, j) + index.match(i, j, shared_ranks) for (i, j, shared_ranks) in candidates)
+                pairs = select_pairs(matches, min_similarity, top_k, index.overlapping_ranges)
+
+            listed = 0
+            matched = 0
+            num_of_ranges = 0
+            for (i, j, similarity, overlapping_ranges) in track(pairs):
+                listed += 1
+                if similarity > 0:
+                    matched += 1
+                num_of_ranges += len(overlapping_ranges)
+                yield {
+                    "submission_A": keys[i],
+                    "submission_B": keys[j],
+                    "similarity": similarity,
+                    "overlapping_ranges": overlapping_ranges,
+                }
+            measurements["pairs"] = listed
+            measurements["incremental"] = incremental
 
-                checker.check_v2()
-                checkers.append(checker)
-                pbar.update(1)
+        profile_report = instrumentation.stop()
 
-    # Collect result
-    checker_result = []
-    result["result"] = checker_result
-    for c in checkers:
-        checker_result.append({
-            "submission_A": c.path1,
-            "submission_B": c.path2,
-            "similarity": c.similarity,
-            "overlapping_ranges": c.overlapping_ranges,
-        })
+        # Stop datetime
+        end_time = datetime.now()
 
-    # Stop datetime
-    end_time = datetime.now()
+        # Record total time used
+        result["execution_time"] = (end_time - start_time).total_seconds()
 
-    # Record total time used
-    result["execution_time"] = (end_time - start_time).total_seconds()
+        if stats:
+            result["stats"] = {
+                "stages": instrumentation.stages,
+                "files": file_stats,
+                "pairs": {
+                    "total": len(keys) * (len(keys) - 1) // 2,
+                    "listed": listed,
+                    "matched": matched,
+                    "overlapping_ranges": num_of_ranges,
+                    "lsh_candidates": len(lsh_pairs) if lsh_pairs is not None else None,
+                },
+            }
+        if profile_report is not None:
+            result["profile"] = profile_report
+    finally:
+        instrumentation.stop()
 
+
+def driver(
+    AST_class: AST,
+    source_filenames: List[str],
+    function_name: str,
+    function_kind: str,
+    threshold: int,
+    **kwargs
+):
+    """
+    Run the similarity check on a set of submissions, see iter_driver() for
+    the optional arguments
+
+    Returns:
+        A dict with the listed pairs under "result", the warnings, the digests
+        of the submissions and the execution time
+    """
+    result = {}
+    rows = iter_driver(AST_class, source_filenames, function_name, function_kind, threshold, result=result, **kwargs)
+    result["result"] = list(rows)
     return result
 
-def run_test(directory):
+def run_test(directory, workers=None, cache=None, previous=None, min_similarity=0, top_k=None, lsh=None):
+    """
+    Run the similarity check on the Python and C submissions in a directory
+
+    Arguments:
+        directory: The directory of the submissions
+        workers: The number of worker processes, None to run serially
+        cache: A FingerprintCache, None to parse every file
+        previous: The result of an earlier run_test() on the same directory,
+            None to compare every pair from scratch
+        min_similarity, top_k: Limit the pairs listed, see driver()
+        lsh: A MinHashLSH prefilter, None to compare every candidate pair
+
+    Returns:
+        A tuple of (Python result, C result)
+    """
     source_filenames = [os.path.join(directory, f) for f in os.listdir(directory)]
     py_files = [f for f in source_filenames if f.endswith(".py")]
     c_files = [f for f in source_filenames if f.endswith(".c")]
-    result1 = driver(Python_AST, py_files, '*', PYTHON_FUNCTION_KIND, 5)
-    result2 = driver(C_AST, c_files, '*', C_FUNCTION_KIND, 5)
+    previous_python, previous_c = previous if previous is not None else (None, None)
+    # Runs in the background for the app, everything goes into the results
+    options = dict(workers=workers, cache=cache, min_similarity=min_similarity, top_k=top_k, lsh=lsh, progress=False)
+    result1 = driver(Python_AST, py_files, '*', PYTHON_FUNCTION_KIND, 5, previous=previous_python, **options)
+    result2 = driver(C_AST, c_files, '*', C_FUNCTION_KIND, 5, previous=previous_c, **options)
     return result1, result2
     
 
 
 if __name__ == '__main__':
-    if sys.argv[1] == "py":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Check the similarity of Python or C submissions")
+    parser.add_argument("language", choices=["py", "c"])
+    parser.add_argument("files", nargs="*", help="the submissions, the test files by default")
+    parser.add_argument("--function", default=None, help="only compare this function, * for whole files")
+    parser.add_argument("--threshold", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--min-similarity", type=float, default=0)
+    parser.add_argument("--top-k", type=int, default=None)
+    parser.add_argument("--lsh-bands", type=int, default=None, help="prefilter the pairs with MinHash LSH using this many bands")
+    parser.add_argument("--lsh-rows", type=int, default=3, help="permutations per LSH band")
+    parser.add_argument("--ndjson", action="store_true", help="print each pair as a JSON line as soon as it is compared")
+    args = parser.parse_args()
+
+    if args.language == "py":
         ast_class = Python_AST
-        source_filenames = ["testfiles/file1.py", "testfiles/file2.py"]
-        function_name = "fibonacci"
         function_kind = PYTHON_FUNCTION_KIND
-        threshold = 5
-        result = driver(ast_class, source_filenames, function_name, function_kind, threshold)
-        ic(result)
-    elif sys.argv[1] == "c":
+    else:
         ast_class = C_AST
-        source_filenames = ["testfiles/file1.c", "testfiles/file2.c"]
-        function_name = "fibonacci"
         function_kind = C_FUNCTION_KIND
-        threshold = 5
-        result = driver(ast_class, source_filenames, function_name, function_kind, threshold)
-        ic(result)
\ No newline at end of file
+
+    source_filenames = args.files
+    function_name = args.function
+    if len(source_filenames) == 0:
+        source_filenames = [f"testfiles/file1.{args.language}", f"testfiles/file2.{args.language}"]
+        function_name = function_name or "fibonacci"
+    function_name = function_name or "*"
+
+    lsh = MinHashLSH(args.lsh_bands, args.lsh_rows) if args.lsh_bands is not None else None
+    options = dict(workers=args.workers, min_similarity=args.min_similarity, top_k=args.top_k, lsh=lsh)
+    if args.ndjson:
+        result = {}
+        rows = iter_driver(
+            ast_class, source_filenames, function_name, function_kind, args.threshold,
+            progress=False, result=result, **options
+        )
+        for row in rows:
+            sys.stdout.write(json.dumps(row) + "\n")
+            sys.stdout.flush()
+        for warning in result["warnings"]:
+            print(warning, file=sys.stderr)
+    else:
+        from icecream import ic
+
+        result = driver(ast_class, source_filenames, function_name, function_kind, args.threshold, **options)
+        ic(result)
@@ -0,0 +1,368 @@
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+
+from language_parser.Checker import FlattenedTree
+
+
+class FingerprintIndex:
+    """
+    Corpus-level inverted index from (weight, fingerprint) to the submissions
+    and nodes containing that subtree.
+
+    Only subtrees with weight >= threshold are indexed, so two submissions
+    become a candidate pair only if they share at least one such subtree.
+    Pairs without a shared posting have a similarity of 0 and are never
+    compared.
+    """
+    def __init__(self, trees, threshold=5):
+        """
+        Arguments:
+            trees: A dict mapping the path of each submission to its CompactAST
+            threshold: The minimum weight of a subtree to be considered
+        """
+        self.threshold = threshold
+        self.paths = list(trees.keys())
+        # Per file: the nodes in the order Checker.check_v2() visits them. A
+        # node's rank is its position in flattened.order.
+        self.flattened = []
+        # Per file: key -> ranks of the nodes with that key
+        self.keyed = []
+        # key -> list of (file id, ranks of the nodes in that file)
+        self.postings = {}
+
+        for file_id, path in enumerate(self.paths):
+            flattened = FlattenedTree(trees[path])
+            weights = flattened.tree.weights
+            fingerprints = flattened.tree.fingerprints
+            keyed = {}
+            for rank, node in enumerate(flattened.order):
+                # Nodes are sorted by weight, nothing below here can match
+                if weights[node] < threshold:
+                    break
+
+                key = (weights[node], fingerprints[node])
+                if key in keyed:
+                    keyed[key].append(rank)
+                else:
+                    keyed[key] = [rank]
+
+            for key, ranks in keyed.items():
+                if key in self.postings:
+                    self.postings[key].append((file_id, ranks))
+                else:
+                    self.postings[key] = [(file_id, ranks)]
+
+            self.flattened.append(flattened)
+            self.keyed.append(keyed)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def candidates(self, file_id):
+        """
+        Find the submissions after file_id that share at least one subtree
+        with it
+
+        Arguments:
+            file_id: The index of the submission in self.paths
+
+        Returns:
+            A list of (other file id, shared ranks) sorted by the other file id,
+            where shared ranks are the ranks of the nodes in the other
+            submission whose key also occurs in this one
+        """
+        shared = {}
+        for key in self.keyed[file_id]:
+            for (other_id, ranks) in self.postings[key]:
+                if other_id <= file_id:
+                    continue
+                if other_id in shared:
+                    shared[other_id].extend(ranks)
+                else:
+                    shared[other_id] = list(ranks)
+
+        return [(other_id, sorted(shared[other_id])) for other_id in sorted(shared)]
+
+    def candidates_before(self, file_id):
+        """
+        Like candidates(), but for the submissions before file_id
+
+        Arguments:
+            file_id: The index of the submission in self.paths
+
+        Returns:
+            A list of (other file id, shared ranks) sorted by the other file id,
+            where shared ranks are the ranks of the nodes in this submission
+            whose key also occurs in the other one
+        """
+        shared = {}
+        for key, ranks in self.keyed[file_id].items():
+            # Postings are in file id order
+            for (other_id, _) in self.postings[key]:
+                if other_id >= file_id:
+                    break
+                if other_id in shared:
+                    shared[other_id].extend(ranks)
+                else:
+                    shared[other_id] = list(ranks)
+
+        return [(other_id, sorted(shared[other_id])) for other_id in sorted(shared)]
+
+    def shared_ranks(self, file_id1, file_id2):
+        """
+        Returns:
+            The shared ranks of a single pair, as candidates() lists them for
+            file_id2, empty if the submissions share no subtree
+        """
+        keyed1 = self.keyed[file_id1]
+        shared = []
+        for key, ranks in self.keyed[file_id2].items():
+            if key in keyed1:
+                shared.extend(ranks)
+        shared.sort()
+        return shared
+
+    def compare(self, file_id1, file_id2, shared_ranks):
+        """
+        Equivalent to Checker.check_v2() on the two submissions, but only
+        visits the nodes of the second submission listed in shared_ranks
+
+        Arguments:
+            file_id1: The index of submission A
+            file_id2: The index of submission B
+            shared_ranks: The ranks of the nodes in B that share a key with A,
+                as returned by candidates()
+
+        Returns:
+            A tuple of (similarity, overlapping ranges)
+        """
+        similarity, overlaps = self.match(file_id1, file_id2, shared_ranks)
+        return similarity, self.overlapping_ranges(file_id1, file_id2, overlaps)
+
+    def match(self, file_id1, file_id2, shared_ranks):
+        """
+        Like compare(), without building the overlapping ranges
+
+        Returns:
+            A tuple of (similarity, list of matched (node in A, node in B)),
+            the matches can be turned into ranges with overlapping_ranges()
+        """
+        tree1 = self.flattened[file_id1].tree
+        tree2 = self.flattened[file_id2].tree
+        order1 = self.flattened[file_id1].order
+        order2 = self.flattened[file_id2].order
+        keyed1 = self.keyed[file_id1]
+
+        # How many nodes of each key in A were matched or purged so far
+        consumed = {}
+        removed = bytearray(len(tree2))
+        overlaps = []
+        for rank in shared_ranks:
+            node = order2[rank]
+            if removed[node]:
+                continue
+
+            key = (tree2.weights[node], tree2.fingerprints[node])
+            ranks1 = keyed1[key]
+            taken = consumed.get(key, 0)
+            if taken >= len(ranks1):
+                continue
+
+            node1 = order1[ranks1[taken]]
+            consumed[key] = taken + 1
+            overlaps.append((node1, node))
+
+            # Subtrees are contiguous in preorder
+            end = node + tree2.weights[node]
+            removed[node:end] = b"\x01" * (end - node)
+            for sub_node in range(node1, node1 + tree1.weights[node1]):
+                weight = tree1.weights[sub_node]
+                if weight < self.threshold:
+                    continue
+                sub_key = (weight, tree1.fingerprints[sub_node])
+                consumed[sub_key] = consumed.get(sub_key, 0) + 1 # Purge the nodes in the sub tree
+
+        num_of_same_nodes = 0
+        for (node1, _) in overlaps:
+            num_of_same_nodes += tree1.weights[node1]
+
+        similarity = num_of_same_nodes / min(len(tree1), len(tree2))
+        return similarity, overlaps
+
+    def overlapping_ranges(self, file_id1, file_id2, overlaps):
+        """
+        Returns:
+            The overlapping ranges of the matches returned by match()
+        """
+        tree1 = self.flattened[file_id1].tree
+        tree2 = self.flattened[file_id2].tree
+        overlapping_ranges = []
+        for (node1, node2) in overlaps:
+            overlapping_ranges.append({
+                "A_start_pos":  tree1.start_pos(node1),
+                "A_end_pos":    tree1.end_pos(node1),
+                "B_start_pos":  tree2.start_pos(node2),
+                "B_end_pos":    tree2.end_pos(node2),
+            })
+        return overlapping_ranges
+
+
+def select_pairs(matches, min_similarity=0, top_k=None, materialize=None):
+    """
+    Keep the pairs at or above min_similarity and, if top_k is given, only
+    the top_k most similar of them, holding at most top_k pairs at a time
+
+    Arguments:
+        matches: An iterable of (file id 1, file id 2, similarity, payload)
+        min_similarity: The lowest similarity kept
+        top_k: The number of pairs kept, None to keep all of them
+        materialize: A function (file id 1, file id 2, payload) -> overlapping
+            ranges, called for the kept pairs only. None if the payloads
+            already are the ranges.
+
+    Yields:
+        (file id 1, file id 2, similarity, overlapping ranges), in the order
+        of matches without top_k, by decreasing similarity with it
+    """
+    if materialize is None:
+        materialize = lambda file_id1, file_id2, payload: payload
+
+    if top_k is None:
+        for (file_id1, file_id2, similarity, payload) in matches:
+            if similarity >= min_similarity:
+                yield (file_id1, file_id2, similarity, materialize(file_id1, file_id2, payload))
+        return
+
+    # A min-heap of the best pairs so far, on equal similarity the earlier
+    # pair wins like in a stable sort
+    heap = []
+    for (file_id1, file_id2, similarity, payload) in matches:
+        if similarity < min_similarity or top_k <= 0:
+            continue
+        item = (similarity, -file_id1, -file_id2, payload)
+        if len(heap) < top_k:
+            heapq.heappush(heap, item)
+        elif item[:3] > heap[0][:3]:
+            heapq.heapreplace(heap, item)
+
+    heap.sort(key=lambda item: item[:3], reverse=True)
+    for (similarity, file_id1, file_id2, payload) in heap:
+        yield (-file_id1, -file_id2, similarity, materialize(-file_id1, -file_id2, payload))
+
+
+def compare_tile(job):
+    """
+    Compare one tile of the pair matrix. Runs in a worker process, which
+    builds a local index over the trees of its tile only.
+
+    Arguments:
+        job: A tuple of (threshold, row ids, column ids, trees, min_similarity,
+            top_k, pairs) where trees maps every row and column id, in
+            ascending order, to its CompactAST and pairs lists the (row id,
+            column id) to compare, None to compare all pairs sharing a subtree
+
+    Returns:
+        A list of (row id, column id, similarity, overlapping ranges) for the
+        pairs in the tile sharing a subtree, with row id < column id, as
+        selected by select_pairs(). The global top_k pairs are among the
+        top_k pairs of their tiles, so only those are sent back.
+    """
+    threshold, row_ids, col_ids, trees, min_similarity, top_k, pairs = job
+    index = FingerprintIndex(trees, threshold=threshold)
+    local_ids = {file_id: local_id for local_id, file_id in enumerate(index.paths)}
+    col_ids = set(col_ids)
+
+    def candidates():
+        if pairs is not None:
+            for (file_id1, file_id2) in pairs:
+                local_id1 = local_ids[file_id1]
+                local_id2 = local_ids[file_id2]
+                shared_ranks = index.shared_ranks(local_id1, local_id2)
+                if len(shared_ranks) > 0:
+                    yield (file_id1, local_id1, local_id2, shared_ranks)
+            return
+
+        for file_id1 in row_ids:
+            local_id1 = local_ids[file_id1]
+            for (local_id2, shared_ranks) in index.candidates(local_id1):
+                if index.paths[local_id2] in col_ids:
+                    yield (file_id1, local_id1, local_id2, shared_ranks)
+
+    def matches():
+        for (file_id1, local_id1, local_id2, shared_ranks) in candidates():
+            similarity, overlaps = index.match(local_id1, local_id2, shared_ranks)
+            yield (file_id1, index.paths[local_id2], similarity, overlaps)
+
+    def materialize(file_id1, file_id2, overlaps):
+        return index.overlapping_ranges(local_ids[file_id1], local_ids[file_id2], overlaps)
+
+    return list(select_pairs(matches(), min_similarity, top_k, materialize))
+
+
+def compare_parallel(trees, threshold=5, workers=2, tile_size=32, min_similarity=0, top_k=None, pairs=None):
+    """
+    Compare all pairs of submissions in a process pool. The upper triangle
+    of the pair matrix is split into tiles of tile_size rows by tile_size
+    columns, and each worker receives the trees of its tile once.
+
+    Arguments:
+        trees: A dict mapping the path of each submission to its CompactAST
+        threshold: The minimum weight of a subtree to be considered
+        workers: The number of worker processes
+        tile_size: The number of rows and columns in a tile
+        min_similarity, top_k: Drop pairs in the workers already, see
+            select_pairs(). The top_k pairs of each tile are yielded, the
+            caller selects the overall top_k among them.
+        pairs: A set of (file id 1, file id 2) with file id 1 < file id 2 to
+            compare, e.g. from MinHashLSH.candidate_pairs(), None to compare
+            all pairs sharing a subtree. Tiles without any are skipped.
+
+    Yields:
+        (file id 1, file id 2, similarity, overlapping ranges) for the pairs
+        sharing a subtree, in the same order as the serial path. The ids are
+        positions in trees.
+    """
+    compact_asts = list(trees.values())
+    num_files = len(compact_asts)
+
+    pairs_by_tile = {}
+    if pairs is not None:
+        for (i, j) in sorted(pairs):
+            tile = (i - i % tile_size, j - j % tile_size)
+            if tile in pairs_by_tile:
+                pairs_by_tile[tile].append((i, j))
+            else:
+                pairs_by_tile[tile] = [(i, j)]
+
+    jobs = []
+    job_rows = []
+    for row_start in range(0, num_files, tile_size):
+        row_ids = list(range(row_start, min(num_files, row_start + tile_size)))
+        for col_start in range(row_start, num_files, tile_size):
+            col_ids = list(range(col_start, min(num_files, col_start + tile_size)))
+            tile_ids = sorted(set(row_ids) | set(col_ids))
+            tile_pairs = None
+            if pairs is not None:
+                tile_pairs = pairs_by_tile.get((row_start, col_start))
+                if tile_pairs is None:
+                    continue
+                # Only the trees of the pairs are needed
+                tile_ids = sorted({file_id for pair in tile_pairs for file_id in pair})
+            jobs.append((threshold, row_ids, col_ids, {i: compact_asts[i] for i in tile_ids}, min_similarity, top_k, tile_pairs))
+            job_rows.append(row_start)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Tiles come back in submission order; a row block is complete once
+        # the tile of the next row block arrives
+        pending = []
+        current_row = None
+        for row_start, results in zip(job_rows, executor.map(compare_tile, jobs)):
+            if row_start != current_row:
+                pending.sort(key=lambda pair: (pair[0], pair[1]))
+                yield from pending
+                pending = []
+                current_row = row_start
+            pending.extend(results)
+
+        pending.sort(key=lambda pair: (pair[0], pair[1]))
+        yield from pending
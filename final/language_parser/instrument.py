@@ -0,0 +1,78 @@
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Instrumentation:
+    """
+    Collects the per-stage measurements of a driver() run.
+
+    Stages are timed with time.perf_counter(), which is all that happens
+    unless a hook or a profiler is enabled. on_stage is called after each
+    stage, profile wraps the run in cProfile and trace_memory records the
+    peak Python allocations of each stage with tracemalloc.
+    """
+    def __init__(self, on_stage=None, profile=False, trace_memory=False, profile_lines=30):
+        """
+        Arguments:
+            on_stage: A function (stage name, dict of its measurements)
+                called after each stage, or None
+            profile: Whether to run cProfile
+            trace_memory: Whether to trace the allocations with tracemalloc
+            profile_lines: The number of functions in the profile report
+        """
+        self.on_stage = on_stage
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.profile_lines = profile_lines
+        self.stages = {}
+        self.profiler = None
+        self.started_tracemalloc = False
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop(self):
+        """
+        Returns:
+            The profile report sorted by cumulative time, or None without
+            profiling
+        """
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+        if self.profiler is None:
+            return None
+
+        self.profiler.disable()
+        report = io.StringIO()
+        pstats.Stats(self.profiler, stream=report).sort_stats("cumulative").print_stats(self.profile_lines)
+        self.profiler = None
+        return report.getvalue()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure the code run in the with block as the stage name. The dict
+        yielded can be given extra measurements of the stage.
+        """
+        measurements = {}
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        yield measurements
+
+        measurements["seconds"] = time.perf_counter() - start_time
+        if self.trace_memory:
+            measurements["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+        self.stages[name] = measurements
+        if self.on_stage is not None:
+            self.on_stage(name, measurements)
@@ -0,0 +1,98 @@
+import random
+from array import array
+from hashlib import blake2b
+from itertools import combinations
+
+# A Mersenne prime, the permutations are a * x + b modulo it
+PRIME = (1 << 61) - 1
+
+
+class MinHashLSH:
+    """
+    Approximate prefilter of the pairs worth comparing.
+
+    Each submission is reduced to the set of (weight, fingerprint) keys of
+    its subtrees at or above the threshold, the subtrees FingerprintIndex
+    can match, and sketched with bands * rows MinHash permutations. Two
+    submissions become a candidate pair when all rows of at least one band
+    of their sketches agree, which happens with probability
+    1 - (1 - J ** rows) ** bands for a Jaccard similarity J of their sets.
+
+    More bands find more of the similar pairs, more rows let fewer of the
+    dissimilar ones through. The candidates are still compared exactly, so
+    the prefilter only ever drops pairs, it never changes a similarity.
+    """
+    def __init__(self, bands=20, rows=3, seed=0):
+        """
+        Arguments:
+            bands: The number of bands of a sketch
+            rows: The number of permutations per band
+            seed: The seed of the permutations
+        """
+        self.bands = bands
+        self.rows = rows
+        self.seed = seed
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, PRIME), rng.randrange(PRIME)) for _ in range(bands * rows)]
+
+    def settings(self):
+        return {"bands": self.bands, "rows": self.rows, "seed": self.seed}
+
+    def estimated_threshold(self):
+        """
+        Returns:
+            The Jaccard similarity at which a pair becomes a candidate with
+            a probability of about one half
+        """
+        return (1 / self.bands) ** (1 / self.rows)
+
+    def sketch(self, tree, threshold=5):
+        """
+        Arguments:
+            tree: A CompactAST hashed with HASH64_FINGERPRINTS, the only
+                fingerprints that don't depend on the process or on the
+                order the files were hashed in
+            threshold: The minimum weight of a subtree to be considered
+
+        Returns:
+            A tuple of bands * rows minimums, None if no subtree reaches the
+            threshold. Sketches of the same tree are the same in every
+            process.
+        """
+        weights = tree.weights
+        fingerprints = tree.fingerprints
+        features = set()
+        for node in range(len(tree)):
+            if weights[node] >= threshold:
+                key = array("Q", (weights[node], fingerprints[node])).tobytes()
+                features.add(int.from_bytes(blake2b(key, digest_size=8).digest(), "little") % PRIME)
+        if len(features) == 0:
+            return None
+
+        return tuple(min([(a * x + b) % PRIME for x in features]) for (a, b) in self.permutations)
+
+    def candidate_pairs(self, sketches):
+        """
+        Arguments:
+            sketches: A list of sketches, as returned by sketch()
+
+        Returns:
+            A set of (file id 1, file id 2) with file id 1 < file id 2 for
+            the sketches sharing a band, the ids being positions in sketches
+        """
+        buckets = {}
+        for file_id, sketch in enumerate(sketches):
+            if sketch is None:
+                continue
+            for band in range(self.bands):
+                key = (band, sketch[band * self.rows:(band + 1) * self.rows])
+                if key in buckets:
+                    buckets[key].append(file_id)
+                else:
+                    buckets[key] = [file_id]
+
+        pairs = set()
+        for file_ids in buckets.values():
+            if len(file_ids) > 1:
+                pairs.update(combinations(file_ids, 2))
+        return pairs
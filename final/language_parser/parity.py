@@ -0,0 +1,206 @@
+"""
+Regression check of the fast comparison paths against Checker.check_v2().
+
+FingerprintIndex, the tiled compare_parallel() and compare_incremental() of
+the driver replace check_v2() and must list the same pairs with the same
+similarity and overlapping ranges. This compares all of them with check_v2()
+on every pair of a corpus: the files in language_parser/testfiles by
+default, or the given files and directories, each file and each of its
+functions being a submission. It exits with 1 on any difference:
+
+    python -m language_parser.parity
+    python -m language_parser.parity corpus/python corpus/c
+
+Run from the directory holding language_parser, like the app.
+"""
+import argparse
+import os
+import sys
+
+from language_parser.AST import HASH64_FINGERPRINTS, InternedFingerprints
+from language_parser.Checker import Checker
+from language_parser.driver import compare_incremental
+from language_parser.index import FingerprintIndex, compare_parallel, select_pairs
+from language_parser.pythonast import Python_AST, PYTHON_FUNCTION_KIND
+from language_parser.c_ast import C_AST, C_FUNCTION_KIND
+
+TESTFILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testfiles")
+
+# Extension -> (AST class, function kind)
+LANGUAGES = {
+    ".py": (Python_AST, PYTHON_FUNCTION_KIND),
+    ".c": (C_AST, C_FUNCTION_KIND),
+}
+
+FINGERPRINTS = {
+    "interned": InternedFingerprints,
+    "hash64": lambda: HASH64_FINGERPRINTS,
+}
+
+
+def load_corpus(paths, extension, fingerprints):
+    """
+    Arguments:
+        paths: Files and directories of submissions
+        extension: The extension of the files to load, a key of LANGUAGES
+        fingerprints: The fingerprinting mode
+
+    Returns:
+        A dict mapping a label of each submission to its CompactAST: each
+        file, and each function of it as "path:name"
+    """
+    AST_class, function_kind = LANGUAGES[extension]
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(os.path.join(path, name) for name in sorted(os.listdir(path)))
+        else:
+            filenames.append(path)
+
+    trees = {}
+    for filename in filenames:
+        if os.path.splitext(filename)[1] != extension:
+            continue
+        compact_ast = AST_class.create_compact(filename, fingerprints)
+        trees[filename] = compact_ast
+        for (kind, name) in compact_ast.names.values():
+            if kind == function_kind:
+                trees[f"{filename}:{name.decode(errors='replace')}"] = compact_ast.subtree(kind, name)
+    return trees
+
+
+def reference_pairs(trees, threshold):
+    """
+    Returns:
+        A list of (file id 1, file id 2, similarity, overlapping ranges) of
+        check_v2() for the pairs with a non-zero similarity, in the order of
+        driver()
+    """
+    keys = list(trees.keys())
+    pairs = []
+    for i in range(len(keys)):
+        for j in range(i + 1, len(keys)):
+            checker = Checker(keys[i], keys[j], trees[keys[i]], trees[keys[j]], threshold)
+            checker.check_v2()
+            if checker.similarity > 0:
+                pairs.append((i, j, checker.similarity, checker.overlapping_ranges))
+    return pairs
+
+
+def serial_pairs(trees, threshold, top_k=None):
+    # The serial path of driver()
+    index = FingerprintIndex(trees, threshold=threshold)
+    matches = (
+        (i, j) + index.match(i, j, shared_ranks)
+        for i in range(len(index))
+        for (j, shared_ranks) in index.candidates(i)
+    )
+    return list(select_pairs(matches, top_k=top_k, materialize=index.overlapping_ranges))
+
+
+def tiled_pairs(trees, threshold, workers, top_k=None, pairs=None):
+    # The parallel path of driver(), with tiles small enough that even a few
+    # submissions are split over several of them
+    tile_size = max(2, (len(trees) + 3) // 4)
+    tiles = compare_parallel(trees, threshold, workers=workers, tile_size=tile_size, top_k=top_k, pairs=pairs)
+    return list(select_pairs(tiles, top_k=top_k))
+
+
+def incremental_pairs(trees, threshold):
+    """
+    compare_incremental() against a previous result of the same submissions
+    listed in a rotated order, so some pairs are listed the other way round,
+    where every third submission changed since. The stale rows of the
+    changed submissions have a similarity of -1, so reusing one shows up as
+    a difference.
+    """
+    keys = list(trees.keys())
+    middle = len(keys) // 2
+    previous_keys = keys[middle:] + keys[:middle]
+    previous_trees = {key: trees[key] for key in previous_keys}
+    changed = set(keys[::3])
+
+    rows = []
+    for (i, j, similarity, overlapping_ranges) in reference_pairs(previous_trees, threshold):
+        path1, path2 = previous_keys[i], previous_keys[j]
+        if path1 in changed or path2 in changed:
+            similarity = -1
+        rows.append({
+            "submission_A": path1,
+            "submission_B": path2,
+            "similarity": similarity,
+            "overlapping_ranges": overlapping_ranges,
+        })
+
+    digests = {key: "current" for key in keys}
+    previous = {
+        "digests": {key: "previous" if key in changed else "current" for key in keys},
+        "result": rows,
+    }
+    return compare_incremental(trees, digests, previous, threshold)
+
+
+def top_k_pairs(pairs, top_k):
+    # Equal similarities keep the listing order, like a stable sort
+    return sorted(pairs, key=lambda pair: pair[2], reverse=True)[:top_k]
+
+
+def check_corpus(trees, threshold, workers):
+    """
+    Returns:
+        A list of (name of the path, number of pairs differing from
+        check_v2()) for every path
+    """
+    expected = reference_pairs(trees, threshold)
+    num_files = len(trees)
+    all_pairs = {(i, j) for i in range(num_files) for j in range(i + 1, num_files)}
+    top_k = max(1, len(expected) // 2)
+
+    results = [
+        ("index", expected, serial_pairs(trees, threshold)),
+        ("tiled", expected, tiled_pairs(trees, threshold, workers)),
+        ("tiled pairs", expected, tiled_pairs(trees, threshold, workers, pairs=all_pairs)),
+        ("incremental", expected, incremental_pairs(trees, threshold)),
+        ("top_k", top_k_pairs(expected, top_k), serial_pairs(trees, threshold, top_k)),
+        ("tiled top_k", top_k_pairs(expected, top_k), tiled_pairs(trees, threshold, workers, top_k)),
+    ]
+    return [(name, count_differences(reference, pairs)) for (name, reference, pairs) in results]
+
+
+def count_differences(expected, pairs):
+    """
+    Returns:
+        The number of positions at which the two lists of (file id 1, file
+        id 2, similarity, overlapping ranges) differ, missing or extra pairs
+        included
+    """
+    differences = abs(len(expected) - len(pairs))
+    for (expected_pair, pair) in zip(expected, pairs):
+        if tuple(expected_pair) != tuple(pair):
+            differences += 1
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the fast comparison paths with Checker.check_v2()")
+    parser.add_argument("paths", nargs="*", default=[TESTFILES], help="files and directories of submissions")
+    parser.add_argument("--threshold", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    failed = False
+    for extension in LANGUAGES:
+        for name, fingerprints in FINGERPRINTS.items():
+            trees = load_corpus(args.paths, extension, fingerprints())
+            if len(trees) < 2:
+                continue
+            for (check, differences) in check_corpus(trees, args.threshold, args.workers):
+                failed = failed or differences > 0
+                outcome = "ok" if differences == 0 else f"{differences} pairs differ"
+                print(f"{extension:>3} {name:>8} {check:>12}: {outcome} ({len(trees)} submissions)")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import threading
+
+
+def _load_python():
+    import tree_sitter_python as tspython
+    from tree_sitter import Language
+    return Language(tspython.language(), "python")
+
+
+def _load_c():
+    import tree_sitter_c as tsc
+    from tree_sitter import Language
+    return Language(tsc.language(), "c")
+
+
+# Language name -> function loading its tree-sitter grammar
+LANGUAGE_LOADERS = {
+    "python": _load_python,
+    "c": _load_c,
+}
+
+# Language name -> distribution of its tree-sitter grammar, whose version
+# decides the node kinds
+LANGUAGE_PACKAGES = {
+    "python": "tree_sitter_python",
+    "c": "tree_sitter_c",
+}
+
+_languages = {}
+_languages_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_language(name):
+    """
+    Load a tree-sitter grammar on first use
+
+    Arguments:
+        name: The language name, a key of LANGUAGE_LOADERS
+
+    Returns:
+        The tree-sitter Language
+    """
+    language = _languages.get(name)
+    if language is None:
+        with _languages_lock:
+            language = _languages.get(name)
+            if language is None:
+                language = LANGUAGE_LOADERS[name]()
+                _languages[name] = language
+    return language
+
+
+def get_parser(name):
+    """
+    Get the parser of a language for the current thread. Parsers are not
+    thread-safe, so each thread gets its own one, which is reused across
+    files.
+
+    Arguments:
+        name: The language name, a key of LANGUAGE_LOADERS
+
+    Returns:
+        A tree-sitter Parser set to the language
+    """
+    parsers = getattr(_local, "parsers", None)
+    if parsers is None:
+        parsers = {}
+        _local.parsers = parsers
+
+    parser = parsers.get(name)
+    if parser is None:
+        from tree_sitter import Parser
+        parser = Parser()
+        parser.set_language(get_language(name))
+        parsers[name] = parser
+    return parser
@@ -1,11 +1,10 @@
 import os
-from tree_sitter import Language, Parser
-import tree_sitter_python as tspython
 from typing import List
 
-from language_parser.AST import AST, ASTGenerationException
+from language_parser.AST import AST, CompactAST, ASTGenerationException, SHA256_FINGERPRINTS
+from language_parser.parsers import get_parser
 
-PYTHON_LANG = Language(tspython.language(), "python")
+PYTHON_LANGUAGE = "python"
 PYTHON3_FUNCTION_KIND = "FunctionDef"
 PYTHON_FUNCTION_KIND = "function_definition"
 PYTHON_IDENTIFIER_KIND = "identifier"
@@ -16,7 +15,20 @@ PYTHON_IGNORE_KINDS = {
 }
 
 
+def python_function_name(node):
+    for child in node.children:
+        if child.type == PYTHON_IDENTIFIER_KIND:
+            return child.text
+    return ""
+
+PYTHON_NAME_GETTERS = {
+    PYTHON_FUNCTION_KIND: python_function_name
+}
+
+
 class Python_AST(AST):
+    LANGUAGE = PYTHON_LANGUAGE
+
     def __init__(self, parent=None, name=None, text=None, start_pos=None, end_pos=None, kind=None):
         AST.__init__(self, parent, name, text, start_pos, end_pos, kind)
 
@@ -59,9 +71,21 @@ class Python_AST(AST):
             return python_ast_node
 
         with open(path, "rb") as f:
-            parser = Parser()
-            parser.set_language(PYTHON_LANG)
+            parser = get_parser(PYTHON_LANGUAGE)
 
             tree = parser.parse(f.read())
             cursor = tree.walk()
-            return helper(cursor)
\ No newline at end of file
+            return helper(cursor)
+
+    @classmethod
+    def create_compact(cls, path, fingerprints=SHA256_FINGERPRINTS):
+        with open(path, "rb") as f:
+            parser = get_parser(PYTHON_LANGUAGE)
+
+            tree = parser.parse(f.read())
+            return CompactAST.from_cursor(
+                tree.walk(),
+                fingerprints,
+                ignore_kinds=PYTHON_IGNORE_KINDS,
+                name_getters=PYTHON_NAME_GETTERS,
+            )
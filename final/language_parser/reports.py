@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# The signature of an entry nothing was computed for yet
+NOT_COMPUTED = object()
+
+
+def directory_signature(directory):
+    """
+    Returns:
+        The (name, mtime, size) of every file in a directory, None if the
+        directory doesn't exist. It changes whenever a submission is added,
+        replaced or removed.
+    """
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return None
+
+    files = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        files.append((entry.name, stat.st_mtime_ns, stat.st_size))
+    files.sort()
+    return tuple(files)
+
+
+class ReportEntry:
+    def __init__(self):
+        self.report = None
+        self.error = None
+        # The directory signature of the last computation, successful or not
+        self.signature = NOT_COMPUTED
+        # The directory signature the report was computed for
+        self.report_signature = NOT_COMPUTED
+        self.computed_at = None
+        self.running = False
+        # The directory signature the running computation started from
+        self.computing_signature = None
+        # Set when the directory changed during the running computation
+        self.dirty = False
+
+
+class SimilarityReports:
+    """
+    Similarity reports computed in the background and kept per directory.
+
+    A report is recomputed only when the files of its directory change.
+    Requests arriving while a report is being computed share that
+    computation, and changes made during it trigger one more run once it
+    ends. Each run is given the previous report so it can be incremental.
+    """
+    def __init__(self, compute, workers=1):
+        """
+        Arguments:
+            compute: A function (directory, previous report or None) ->
+                report, e.g. run_test()
+            workers: The number of reports computed at once
+        """
+        self.compute = compute
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.entries = {}
+        self.condition = threading.Condition()
+
+    def _entry(self, directory):
+        if directory not in self.entries:
+            self.entries[directory] = ReportEntry()
+        return self.entries[directory]
+
+    def _request(self, entry, directory, signature):
+        # Called with the condition held
+        if entry.running:
+            if signature != entry.computing_signature:
+                entry.dirty = True
+            return
+        entry.running = True
+        self.executor.submit(self._run, entry, directory)
+
+    def _run(self, entry, directory):
+        while True:
+            signature = directory_signature(directory)
+            with self.condition:
+                entry.dirty = False
+                entry.computing_signature = signature
+                previous = entry.report
+
+            try:
+                report = self.compute(directory, previous)
+                error = None
+            except Exception as e:
+                report = None
+                error = f"{type(e).__name__}: {e}"
+
+            with self.condition:
+                if error is None:
+                    entry.report = report
+                    entry.report_signature = signature
+                    entry.computed_at = time.time()
+                entry.error = error
+                entry.signature = signature
+                self.condition.notify_all()
+                if not entry.dirty:
+                    entry.running = False
+                    entry.computing_signature = None
+                    return
+
+    def refresh(self, directory):
+        """
+        Start computing the report of a directory in the background, unless
+        it is up to date or already being computed
+        """
+        signature = directory_signature(directory)
+        with self.condition:
+            entry = self._entry(directory)
+            if signature != entry.signature:
+                self._request(entry, directory, signature)
+
+    def get(self, directory, wait=True):
+        """
+        Get the latest report of a directory, starting a new computation if
+        the directory changed since
+
+        Arguments:
+            directory: The directory of the submissions
+            wait: Whether to wait for the computation when there is no report
+                at all yet, a stale report is always returned right away
+
+        Returns:
+            A dict with the report (None if there is none), the time it was
+            computed at, whether it is stale, whether a computation is
+            running and the error of the last computation, if it failed
+        """
+        signature = directory_signature(directory)
+        with self.condition:
+            entry = self._entry(directory)
+            if signature != entry.signature:
+                self._request(entry, directory, signature)
+
+            while wait and entry.report is None and entry.running:
+                self.condition.wait()
+
+            return {
+                "report": entry.report,
+                "computed_at": entry.computed_at,
+                "stale": entry.report_signature != signature,
+                "computing": entry.running,
+                "error": entry.error,
+            }